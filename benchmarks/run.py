@@ -0,0 +1,262 @@
+# benchmarks/run.py
+"""
+Бенчмарки горячих путей: декодирование Protobuf, применение дельт к стакану
+и отрисовка стакана. Работают офлайн на синтетическом или записанном потоке.
+
+    python -m benchmarks.run                       # полный прогон, результат в benchmarks/results/latest.json
+    python -m benchmarks.run --quick               # короткий прогон
+    python -m benchmarks.run --stream rec.bin      # на записанном потоке (tools/recorder.py)
+    python -m benchmarks.run --compare base.json   # сравнение с сохраненным результатом
+
+Для каждого случая: сообщений в секунду, p50/p99 задержки на сообщение и
+выделения памяти на сообщение (отдельным проходом под tracemalloc, чтобы
+трассировка не искажала время).
+
+Стаканы строятся без политики хранения уровней (BOOK_MAX_LEVELS и др.):
+случай "1000 lvl" действительно держит 1000 уровней на сторону.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from benchmarks.streams import read_stream, synthetic_stream
+from services.orderbook import OrderBook
+from services.pool import MexcConnectionPool
+from services.socket import MexcSocketService
+from utils import format_orderbook
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+RENDER_DEPTH = 20 # Максимальная глубина в интерфейсе бота
+
+# Случай бенчмарка: (имя, setup). setup() готовит состояние и возвращает функцию одного сообщения
+Case = Tuple[str, Callable[[], Callable[[Any], Any]]]
+
+
+def _percentile(sorted_values: List[int], q: float) -> float:
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _make_service(symbol: str) -> MexcSocketService:
+    """Сервис стакана без пула и сети; стакан без политики хранения, чтобы глубина случая не обрезалась."""
+    service = MexcSocketService(symbol, None, None, None)
+    service.book = OrderBook()
+    return service
+
+
+def _make_services(snapshots: Dict[str, dict]) -> Dict[str, MexcSocketService]:
+    """Стаканы символов с загруженными снимками (без пула и сети)."""
+    services = {}
+    for symbol, snapshot in snapshots.items():
+        service = _make_service(symbol)
+        service.book.load_snapshot(snapshot["asks"], snapshot["bids"], snapshot["lastUpdateId"])
+        service.snapshot_loaded = True
+        services[symbol] = service
+    return services
+
+
+def _service_for(services: Dict[str, MexcSocketService], symbol: str) -> MexcSocketService:
+    # В записанном потоке символы заранее неизвестны: стакан без снимка начинается пустым
+    service = services.get(symbol)
+    if service is None:
+        service = services[symbol] = _make_service(symbol)
+        service.snapshot_loaded = True
+    return service
+
+
+def build_cases(snapshots: Dict[str, dict], frames: List[bytes]) -> List[Case]:
+    pool = MexcConnectionPool()
+    decode = pool._deserialize_protobuf
+
+    def setup_decode():
+        return decode
+
+    def setup_apply():
+        services = _make_services(snapshots)
+        # Декодирование вынесено из замера: только проверка версии и применение дельты
+        updates = {id(raw): decode(raw) for raw in frames}
+
+        def apply(raw):
+            update = updates[id(raw)]
+            _service_for(services, update.symbol).handle_update(update)
+        return apply
+
+    def setup_pipeline():
+        services = _make_services(snapshots)
+
+        def pipeline(raw):
+            update = decode(raw)
+            _service_for(services, update.symbol).handle_update(update)
+        return pipeline
+
+    def setup_render():
+        services = _make_services(snapshots)
+
+        def render(raw):
+            # Дельта + отрисовка новой ревизии (промах кэша отрисовки, как у первого зрителя)
+            update = decode(raw)
+            service = _service_for(services, update.symbol)
+            service.handle_update(update)
+            return format_orderbook(update.symbol, service.get_latest_data(RENDER_DEPTH), RENDER_DEPTH)
+        return render
+
+    def setup_render_cached():
+        services = _make_services(snapshots)
+        for raw in frames:
+            update = decode(raw)
+            _service_for(services, update.symbol).handle_update(update)
+        views = {symbol: service.get_latest_data(RENDER_DEPTH) for symbol, service in services.items()}
+
+        def render_cached(raw):
+            # Повторная отрисовка той же ревизии (остальные зрители того же символа)
+            symbol = decode(raw).symbol
+            return format_orderbook(symbol, views[symbol], RENDER_DEPTH)
+        return render_cached
+
+    return [
+        ("decode", setup_decode),
+        ("apply", setup_apply),
+        ("decode+apply", setup_pipeline),
+        ("decode+apply+render", setup_render),
+        ("render_cached", setup_render_cached),
+    ]
+
+
+def measure(setup: Callable, frames: List[bytes]) -> Dict[str, float]:
+    """Замер одного случая: время на сообщение, затем выделения памяти отдельным проходом."""
+    clock = time.perf_counter_ns
+    fn = setup()
+    gc.collect()
+    timings = []
+    append = timings.append
+    started = clock()
+    for raw in frames:
+        t0 = clock()
+        fn(raw)
+        append(clock() - t0)
+    total = clock() - started
+    timings.sort()
+
+    # Выделения: прирост пика трассируемой памяти и число выделенных блоков, оставшихся после прохода
+    fn = setup()
+    gc.collect()
+    tracemalloc.start()
+    base_current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    blocks_before = sys.getallocatedblocks()
+    for raw in frames:
+        fn(raw)
+    blocks_after = sys.getallocatedblocks()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    n = len(frames)
+    return {
+        "messages": n,
+        "msgs_per_s": round(n / (total / 1e9), 1),
+        "mean_us": round(total / n / 1000, 2),
+        "p50_us": round(_percentile(timings, 0.50) / 1000, 2),
+        "p99_us": round(_percentile(timings, 0.99) / 1000, 2),
+        "peak_bytes_per_msg": round((peak - base_current) / n, 1),
+        "retained_bytes_per_msg": round((current - base_current) / n, 1),
+        "retained_blocks_per_msg": round((blocks_after - blocks_before) / n, 3),
+    }
+
+
+def run(matrix: List[Tuple[int, int]], messages: int, stream: Optional[str]) -> List[Dict[str, Any]]:
+    results = []
+    if stream:
+        frames = [raw for _, raw in read_stream(stream)][:messages or None]
+        datasets = [({}, frames, {"stream": os.path.basename(stream)})]
+    else:
+        datasets = []
+        for symbols, levels in matrix:
+            snapshots, frames = synthetic_stream(symbols, messages, levels)
+            datasets.append((snapshots, frames, {"symbols": symbols, "levels": levels}))
+
+    for snapshots, frames, params in datasets:
+        for name, setup in build_cases(snapshots, frames):
+            result = {"case": name, **params, **measure(setup, frames)}
+            results.append(result)
+            print(_format_row(result), flush=True)
+    return results
+
+
+def _case_key(result: Dict[str, Any]) -> Tuple:
+    return result["case"], result.get("symbols"), result.get("levels"), result.get("stream")
+
+
+def _format_row(result: Dict[str, Any]) -> str:
+    params = result.get("stream") or f"{result['symbols']:>3} sym x {result['levels']:>4} lvl"
+    return (
+        f"{result['case']:<22} {params:<20} {result['msgs_per_s']:>12,.0f} msg/s  "
+        f"p50 {result['p50_us']:>8.2f}us  p99 {result['p99_us']:>8.2f}us  "
+        f"peak {result['peak_bytes_per_msg']:>8.1f} B/msg"
+    )
+
+
+def compare(current: List[Dict[str, Any]], baseline_path: str, threshold: float) -> bool:
+    """Печатает изменения относительно сохраненного результата. Возвращает True при регрессии."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {_case_key(r): r for r in json.load(f)["results"]}
+    regressed = False
+    print(f"\nCompared with {baseline_path} (regression threshold {threshold:.0%}):")
+    for result in current:
+        base = baseline.get(_case_key(result))
+        if base is None:
+            continue
+        throughput = result["msgs_per_s"] / base["msgs_per_s"] - 1
+        p99 = result["p99_us"] / base["p99_us"] - 1 if base["p99_us"] else 0.0
+        flag = ""
+        if throughput < -threshold or p99 > threshold:
+            flag = "  <-- REGRESSION"
+            regressed = True
+        params = result.get("stream") or f"{result['symbols']} sym x {result['levels']} lvl"
+        print(f"{result['case']:<22} {params:<20} msg/s {throughput:+7.1%}  p99 {p99:+7.1%}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Order book hot path benchmarks")
+    parser.add_argument("--quick", action="store_true", help="short run (fewer messages and sizes)")
+    parser.add_argument("--messages", type=int, default=None, help="messages per case")
+    parser.add_argument("--stream", help="recorded stream file instead of synthetic data")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "latest.json"), help="where to save results")
+    parser.add_argument("--compare", help="saved results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change treated as regression")
+    args = parser.parse_args()
+
+    if args.quick:
+        matrix = [(1, 200), (50, 200)]
+        messages = args.messages or 5000
+    else:
+        matrix = [(1, 100), (1, 1000), (50, 100), (50, 1000), (500, 200)]
+        messages = args.messages or 50000
+
+    results = run(matrix, messages, args.stream)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "retention": "off", # Стаканы не обрезаются политикой хранения
+            "args": vars(args),
+            "results": results,
+        }, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# benchmarks/streams.py
+import json
+import random
+import struct
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import PushDataV3ApiWrapper_pb2
+
+from services.pool import depth_topic
+
+# Формат файла записанного потока: заголовок STREAM_MAGIC, затем записи
+# <время получения (double, сек)><тип (uint8)><длина (uint32)><данные>.
+# RECORD_FRAME - сырое сообщение WebSocket (PushDataV3ApiWrapper),
+# RECORD_SNAPSHOT - JSON {"symbol": ..., "data": ответ REST /api/v3/depth}.
+# Этот формат пишет рекордер живого потока MEXC (tools/recorder.py).
+STREAM_MAGIC = b"MEXCWS1\n"
+_RECORD_HEADER = struct.Struct("<dBI")
+RECORD_FRAME = 0
+RECORD_SNAPSHOT = 1
+
+# Сообщение потока: (время получения, сырые байты PushDataV3ApiWrapper)
+Frame = Tuple[float, bytes]
+# Запись файла потока: (время получения, тип записи, данные)
+Record = Tuple[float, int, bytes]
+
+
+def write_record(fp: BinaryIO, received_at: float, kind: int, payload: bytes):
+    """Дописывает одну запись в открытый файл потока."""
+    fp.write(_RECORD_HEADER.pack(received_at, kind, len(payload)))
+    fp.write(payload)
+
+
+def write_frame(fp: BinaryIO, received_at: float, raw: bytes):
+    """Дописывает одно сообщение WebSocket в открытый файл потока."""
+    write_record(fp, received_at, RECORD_FRAME, raw)
+
+
+def write_snapshot(fp: BinaryIO, received_at: float, symbol: str, data: dict):
+    """Дописывает REST-снимок стакана символа в открытый файл потока."""
+    write_record(fp, received_at, RECORD_SNAPSHOT, json.dumps({"symbol": symbol, "data": data}).encode())
+
+
+def write_stream(path: str, frames: List[Frame]):
+    """Сохраняет поток сообщений в файл."""
+    with open(path, "wb") as fp:
+        fp.write(STREAM_MAGIC)
+        for received_at, raw in frames:
+            write_frame(fp, received_at, raw)
+
+
+def read_records(path: str) -> Iterator[Record]:
+    """Читает файл потока, запись за записью."""
+    with open(path, "rb") as fp:
+        if fp.read(len(STREAM_MAGIC)) != STREAM_MAGIC:
+            raise ValueError(f"{path}: not a recorded MEXC stream")
+        while True:
+            header = fp.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                return
+            received_at, kind, length = _RECORD_HEADER.unpack(header)
+            payload = fp.read(length)
+            if len(payload) < length:
+                return # Оборванная последняя запись (рекордер остановлен посреди записи)
+            yield received_at, kind, payload
+
+
+def read_stream(path: str) -> Iterator[Frame]:
+    """Читает из файла потока только сообщения WebSocket."""
+    for received_at, kind, payload in read_records(path):
+        if kind == RECORD_FRAME:
+            yield received_at, payload
+
+
+def depth_frame(symbol: str, asks: List[Tuple[str, str]], bids: List[Tuple[str, str]],
+                from_version: int, to_version: int, send_time: int = 0) -> bytes:
+    """Собирает сообщение PushDataV3ApiWrapper с publicAggreDepths (как присылает MEXC)."""
+    wrapper = PushDataV3ApiWrapper_pb2.PushDataV3ApiWrapper()
+    wrapper.channel = depth_topic(symbol)
+    wrapper.symbol = symbol
+    wrapper.sendTime = send_time
+    depth = wrapper.publicAggreDepths
+    depth.eventType = wrapper.channel.rsplit("@", 1)[0]
+    for price, quantity in asks:
+        item = depth.asks.add()
+        item.price, item.quantity = price, quantity
+    for price, quantity in bids:
+        item = depth.bids.add()
+        item.price, item.quantity = price, quantity
+    depth.fromVersion = str(from_version)
+    depth.toVersion = str(to_version)
+    return wrapper.SerializeToString()
+
+
+class SyntheticMarket:
+    """
+    Синтетический стакан одного символа для бенчмарков: REST-снимок и поток
+    дельт с последовательными версиями. Mid-цена случайно блуждает, уровни
+    появляются, меняются и удаляются около нее (как в агрегированном потоке MEXC).
+    """
+    def __init__(self, symbol: str, levels: int = 200, decimals: int = 2, mid: float = 100.0,
+                 seed: Optional[int] = None):
+        self.symbol = symbol
+        self.levels = levels # Уровней на сторону в снимке
+        self.decimals = decimals
+        self.tick = 10 ** -decimals
+        self.mid_ticks = int(mid / self.tick)
+        self.version = 1
+        self.random = random.Random(seed)
+
+    def _price(self, ticks: int) -> str:
+        return f"{ticks * self.tick:.{self.decimals}f}"
+
+    def _qty(self) -> str:
+        return f"{self.random.uniform(0.001, 50):.4f}"
+
+    def snapshot(self) -> dict:
+        """Снимок в формате REST /api/v3/depth."""
+        return {
+            "lastUpdateId": self.version,
+            "asks": [[self._price(self.mid_ticks + 1 + i), self._qty()] for i in range(self.levels)],
+            "bids": [[self._price(self.mid_ticks - 1 - i), self._qty()] for i in range(self.levels)],
+        }
+
+    def next_frame(self, changes: int = 10) -> bytes:
+        """Следующая дельта: changes изменений уровней (около четверти - удаления)."""
+        rnd = self.random
+        self.mid_ticks = max(self.levels + 2, self.mid_ticks + rnd.choice((-1, 0, 0, 1)))
+        asks, bids = [], []
+        for _ in range(changes):
+            # Изменения чаще происходят у лучших цен
+            distance = 1 + int(rnd.expovariate(1 / 8)) % self.levels
+            qty = "0" if rnd.random() < 0.25 else self._qty()
+            if rnd.random() < 0.5:
+                asks.append((self._price(self.mid_ticks + distance), qty))
+            else:
+                bids.append((self._price(self.mid_ticks - distance), qty))
+        from_version = self.version + 1
+        self.version += 1
+        return depth_frame(self.symbol, asks, bids, from_version, self.version)
+
+
+def synthetic_stream(symbols: int, messages: int, levels: int = 200, changes: int = 10,
+                     seed: int = 1) -> Tuple[Dict[str, dict], List[bytes]]:
+    """
+    Поток messages сообщений, перемешанных между symbols символами.
+    Возвращает снимки стаканов на начало потока ({symbol: снимок}) и сообщения.
+    """
+    markets = [SyntheticMarket(f"SYM{i}USDT", levels, seed=seed + i) for i in range(symbols)]
+    snapshots = {market.symbol: market.snapshot() for market in markets}
+    rnd = random.Random(seed)
+    frames = [rnd.choice(markets).next_frame(changes) for _ in range(messages)]
+    return snapshots, frames
@@ -1,8 +1,67 @@
 # config.py
 import logging # Модуль для настройки логирования
+import os # Адреса MEXC можно переопределить переменными окружения (локальный стенд tools/standin.py)
 
 TOKEN = "TOKEN"  # Токен вашего Telegram-бота
-MEXC_API_URL = "https://api.mexc.com/api/v3/defaultSymbols" # URL для получения рекомендуемых торговых пар (REST)
-MEXC_WS_URL = "wss://wbs-api.mexc.com/ws" # Базовый WebSocket URL для подключения к бирже
+MEXC_REST_URL = os.environ.get("MEXC_REST_URL", "https://api.mexc.com/api/v3") # Базовый URL REST API биржи
+MEXC_API_URL = f"{MEXC_REST_URL}/defaultSymbols" # URL для получения рекомендуемых торговых пар (REST)
+MEXC_WS_URL = os.environ.get("MEXC_WS_URL", "wss://wbs-api.mexc.com/ws") # Базовый WebSocket URL для подключения к бирже
+SYMBOLS_REFRESH_INTERVAL = 600 # Как часто обновлять кэш списка пар в фоне (сек)
+WS_MAX_TOPICS_PER_CONNECTION = 30 # Максимум каналов (символов) на одно WebSocket-соединение (лимит MEXC - 30)
+
+# Переподключение WebSocket-соединений пула
+WS_BACKOFF_BASE = 1.0 # Базовая задержка экспоненциального backoff (сек): попытка n ждет random(0, base * 2^n)
+WS_BACKOFF_CAP = 60.0 # Верхняя граница задержки между попытками (сек)
+WS_CIRCUIT_BREAKER_THRESHOLD = 5 # После скольких неудачных подключений подряд приостановить попытки
+WS_CIRCUIT_BREAKER_COOLDOWN = 120 # На сколько приостановить попытки соединения (сек)
+WS_HEALTHY_CONNECTION_SECONDS = 30 # Соединение, проработавшее столько секунд с данными, считается здоровым (backoff сбрасывается)
+WS_RECV_TIMEOUT = 35.0 # Без сообщений дольше этого соединение считается зависшим и переподключается (сек)
+WS_RATE_EWMA_ALPHA = 0.2 # Коэффициент сглаживания скорости сообщений в метриках здоровья соединения
+
+# Хранение уровней стакана (память на символ)
+BOOK_MAX_LEVELS = 200 # Максимум уровней на сторону стакана (None - без ограничения); UI показывает до 20
+BOOK_MAX_DISTANCE_PCT = 10.0 # Уровни дальше этого процента от лучшей цены своей стороны отбрасываются (None - без ограничения)
+BOOK_MIN_LEVELS = 20 # Сколько лучших уровней стороны хранить всегда, независимо от удаления от цены (максимальная глубина UI); меньше известных уровней до отброшенных - ресинк
+BOOK_RETENTION_OVERRIDES = {} # Политика для отдельных символов: {"BTCUSDT": {"max_levels": 500, "max_distance_pct": 5.0}}
+STORAGE_BACKEND = "json" # Хранилище FSM: "json" (states.json) или "sqlite" (states.db)
+STORAGE_SQLITE_PATH = "states.db" # Файл базы для STORAGE_BACKEND = "sqlite"
+STORAGE_FLUSH_INTERVAL_MS = 500 # Как часто JSONStorage сбрасывает изменения FSM на диск (мс)
+
+# Общий HTTP-клиент (REST API MEXC и загрузка снимков стаканов)
+HTTP_POOL_LIMIT = 100 # Максимум одновременных соединений в пуле
+HTTP_LIMIT_PER_HOST = 20 # Максимум одновременных соединений к одному хосту
+HTTP_TIMEOUT = 10 # Общий таймаут запроса (сек)
+HTTP_DNS_CACHE_TTL = 300 # Время жизни кэша DNS (сек)
+HTTP_KEEPALIVE_TIMEOUT = 30 # Сколько держать простаивающее соединение открытым (сек)
+
+# Восстановление сессий парсинга после перезапуска
+RESTORE_CONCURRENCY = 5 # Сколько символов прогреваются одновременно (REST-снимок + подписка)
+RESTORE_JITTER = 0.5 # Случайная задержка перед прогревом символа (сек)
+RESTORE_WARMUP_TIMEOUT = 15 # Сколько ждать загрузки стакана перед запуском сессий символа (сек)
+
+# Лимиты Telegram Bot API для правок сообщений (планировщик EditScheduler)
+TELEGRAM_GLOBAL_RATE = 25 # Правок в секунду на весь бот (лимит Telegram ~30/с, держим запас)
+TELEGRAM_PER_CHAT_RATE = 1.0 # Правок в секунду на один чат
+TELEGRAM_MAX_IN_FLIGHT = 10 # Одновременных запросов к Bot API
+EDIT_SKIP_INCLUDE_TIMESTAMP = False # True - время в заголовке считается изменением (правка уходит каждый тик)
+ORDERBOOK_SHOW_DATA_TIME = False # True - в подвале сообщения время данных биржи вместо текущего времени в заголовке
+
+# Кэши отрисовки стакана (utils.format_orderbook)
+RENDER_CACHE_SIZE = 1024 # Сколько отрисованных стаканов (символ + глубина) хранить
+FORMAT_CACHE_SIZE = 4096 # Сколько отформатированных цен и строк уровней хранить на символ (LRU, formatting.py)
+
+# Метрики (services/metrics.py): текстовый формат Prometheus на локальном HTTP-адресе
+METRICS_ENABLED = True # Запускать HTTP-сервер метрик вместе с ботом
+METRICS_HOST = "127.0.0.1" # Адрес сервера метрик (только локальный доступ)
+METRICS_PORT = 9108 # Порт сервера метрик: http://127.0.0.1:9108/metrics
+
+# Монитор цикла событий (services/loop_monitor.py) и профилирование по команде /profile
+LOOP_MONITOR_ENABLED = True # Измерять задержку цикла событий и искать медленные колбэки
+LOOP_LAG_INTERVAL = 0.5 # Как часто измерять задержку цикла событий (сек)
+LOOP_SLOW_CALLBACK_MS = 100 # Колбэк дольше этого блокирует цикл: считается и логируется с именем задачи (мс)
+PROFILE_SAMPLE_INTERVAL_MS = 5 # Период сэмплирования стека при профилировании (мс)
+PROFILE_DEFAULT_SECONDS = 10 # Длительность профиля /profile по умолчанию (сек)
+PROFILE_MAX_SECONDS = 60 # Максимальная длительность профиля (сек)
+ADMIN_IDS = [] # Telegram ID пользователей, которым доступны служебные команды (/profile)
 
 logging.basicConfig(level=logging.INFO) # Настройка уровня логирования: INFO и выше будет выводиться в консоль
@@ -0,0 +1,123 @@
+# formatting.py
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import FORMAT_CACHE_SIZE
+
+# Точность форматирования цены, пока точность символа неизвестна
+# (20 знаков обычно достаточно для любой крипты)
+DEFAULT_PRICE_DECIMALS = 20
+
+
+class SymbolFormatter:
+    """
+    Форматирование цен и строк уровней стакана одного символа.
+
+    Формат цены строится заранее из точности цены символа (шаг цены 10^-decimals):
+    цена, кратная шагу, печатается ровно с decimals знаками, без 20-значного
+    представления и шума float в младших разрядах. Отформатированные цены и
+    строки уровней хранятся в ограниченных LRU-кэшах: уровни, которые не
+    изменились между тиками, повторно не форматируются.
+    """
+    __slots__ = ("symbol", "price_decimals", "cache_size", "_price_spec", "_prices", "_rows")
+
+    def __init__(self, symbol: str, price_decimals: Optional[int] = None, cache_size: int = FORMAT_CACHE_SIZE):
+        self.symbol = symbol
+        self.cache_size = cache_size
+        self.price_decimals = None
+        self._price_spec = ""
+        self._prices: "OrderedDict[float, str]" = OrderedDict() # {цена: строка}
+        self._rows: "OrderedDict[Tuple[float, float], str]" = OrderedDict() # {(цена, объем): строка уровня}
+        self.set_price_decimals(price_decimals)
+
+    def set_price_decimals(self, decimals: Optional[int]):
+        """Задает точность цены символа. При смене точности кэши сбрасываются."""
+        decimals = DEFAULT_PRICE_DECIMALS if decimals is None else decimals
+        if decimals == self.price_decimals:
+            return
+        self.price_decimals = decimals
+        self._price_spec = f".{decimals}f"
+        self._prices.clear()
+        self._rows.clear()
+
+    def _cache_put(self, cache: OrderedDict, key, value: str):
+        cache[key] = value
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False) # Вытесняем давно не встречавшееся значение
+
+    def _format_price(self, price: float) -> str:
+        """
+        Компактная нотация цены по точности символа: больше 1 - два знака после
+        запятой, много ведущих нулей (например, 0.00000000123) - запись 0.0{8}123.
+        """
+        # Если цена больше 1, используем стандартный формат (например, 45,000.00)
+        if price > 1.0:
+            return f"{price:,.2f}"
+
+        s_price = format(price, self._price_spec).rstrip('0')
+        if '.' not in s_price:
+            return s_price
+        decimal_part = s_price.partition('.')[2]
+
+        # Ведущие нули дробной части считаются за один проход lstrip, без цикла по символам
+        leading_zeros = len(decimal_part) - len(decimal_part.lstrip('0'))
+
+        # Порог срабатывания: если нулей больше 3 (например, 0.00005)
+        if leading_zeros > 3:
+            significant_digits = decimal_part[leading_zeros:][:5]
+            return f"0.0{{{leading_zeros}}}{significant_digits}"
+
+        # Если нулей мало (например, 0.0012), до 8 знаков
+        return f"{price:.8f}".rstrip('0')
+
+    def price(self, price: float) -> str:
+        """Компактная запись цены (с кэшем)."""
+        cache = self._prices
+        text = cache.get(price)
+        if text is None:
+            text = self._format_price(price)
+            self._cache_put(cache, price, text)
+        else:
+            cache.move_to_end(price)
+        return text
+
+    def row(self, price: float, v: float) -> str:
+        """Строка уровня: цена | объем | сумма в USD, выровненные невидимыми символами '⠀' (с кэшем)."""
+        key = (price, v)
+        cache = self._rows
+        row = cache.get(key)
+        if row is not None:
+            cache.move_to_end(key)
+            return row
+        p = self.price(price)
+        # Форматируем объем: если большой - без дробей, если маленький - с дробями
+        v_str = f"{v:,.0f}" if v > 100 else f"{v:.4f}"
+        v_usd = v * price
+        # Выравнивание с помощью невидимых символов '⠀'
+        t1 = '⠀' * (12 - len(p))  # Выравнивание по цене
+        t2 = '⠀' * (12 - len(v_str))  # Выравнивание по объему
+        row = f"{p} {t1}| {v_str} {t2}| ${v_usd:,.2f}"
+        self._cache_put(cache, key, row)
+        return row
+
+    def side(self, levels: Iterable[Tuple[float, float]]) -> List[str]:
+        """Пакетное форматирование стороны стакана: строки уровней в порядке levels."""
+        row = self.row
+        return [row(price, v) for price, v in levels]
+
+
+# Форматтеры по символам: {symbol: SymbolFormatter}
+_formatters: Dict[str, SymbolFormatter] = {}
+
+
+def get_formatter(symbol: str, price_decimals: Optional[int] = None) -> SymbolFormatter:
+    """
+    Возвращает форматтер символа (создается при первом обращении). Если передана
+    точность цены, форматтер переводится на нее.
+    """
+    formatter = _formatters.get(symbol)
+    if formatter is None:
+        formatter = _formatters[symbol] = SymbolFormatter(symbol, price_decimals)
+    elif price_decimals is not None:
+        formatter.set_price_decimals(price_decimals)
+    return formatter
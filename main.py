@@ -1,31 +1,59 @@
 # main.py
 import asyncio # Для асинхронного программирования и управления задачами
 import logging # Для логирования
+import random # Для случайной задержки при восстановлении сессий
+import time # Возраст данных стакана для трассировки задержки
 from aiogram import Bot, Dispatcher, F # Основные классы Aiogram
 from aiogram.types import Message, CallbackQuery # Типы сообщений и колбэков
-from aiogram.filters import Command # Фильтр для команд /start
+from aiogram.filters import Command, CommandObject # Фильтр для команд /start и аргументы команды
 from aiogram.fsm.context import FSMContext # Контекст FSM (хранение данных и состояния)
 from aiogram.enums import ParseMode # Режим парсинга (Markdown, HTML)
 
 # --- Импорты ---
-from config import TOKEN 
+from config import TOKEN, EDIT_SKIP_INCLUDE_TIMESTAMP, STORAGE_BACKEND, STORAGE_SQLITE_PATH
+from config import RESTORE_CONCURRENCY, RESTORE_JITTER, RESTORE_WARMUP_TIMEOUT
+from config import METRICS_ENABLED, LOOP_MONITOR_ENABLED
+from config import ADMIN_IDS, PROFILE_DEFAULT_SECONDS, PROFILE_MAX_SECONDS
 from states import UserStates, DEFAULT_SETTINGS
+from services.http import HttpClient # Общий HTTP-клиент с пулом соединений
 from services.repository import MexcRepository # Для получения списка пар
-from services.socket import MexcSocketService # Для работы с WebSocket
+from services.catalogue import SymbolCatalogue # Кэшированный каталог пар с поиском
+from services.hub import MarketDataHub # Общие стаканы по символам (поверх общего пула WebSocket-соединений)
+from services.edit_scheduler import EditScheduler # Планировщик правок сообщений с лимитами Telegram
+from services import metrics # Реестр метрик и HTTP-сервер /metrics
+from services.loop_monitor import LoopMonitor # Задержка цикла событий, медленные колбэки, профилирование
 from keyboards import get_pairs_keyboard, get_settings_keyboard, get_stop_parsing_keyboard, get_cancel_keyboard
 from aiogram.utils.keyboard import InlineKeyboardBuilder # Для динамического создания клавиатур
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton 
-from utils import format_orderbook # Для форматирования вывода стакана
-from storage import JSONStorage # Файловое хранилище FSM
+from utils import format_orderbook, orderbook_fingerprint # Для форматирования вывода стакана
+from storage import JSONStorage, SQLiteStorage # Хранилища FSM (файл JSON или SQLite)
 
 # --- Инициализация ---
-storage = JSONStorage("states.json") # Создание файлового хранилища
+# Создание хранилища FSM. SQLite при первом запуске переносит сессии из states.json
+if STORAGE_BACKEND == "sqlite":
+    storage = SQLiteStorage(STORAGE_SQLITE_PATH, migrate_from="states.json")
+else:
+    storage = JSONStorage("states.json")
 bot = Bot(token=TOKEN, parse_mode=ParseMode.MARKDOWN) # Инициализация бота
-dp = Dispatcher(storage=storage) # Инициализация диспетчера с файловым хранилищем
+dp = Dispatcher(storage=storage) # Инициализация диспетчера с выбранным хранилищем FSM
  
 # Хранилище активных задач парсинга: {user_id: asyncio.Task}
 parsing_tasks = {}
-mexc_repository = MexcRepository() # Репозиторий для API запросов
+http_client = HttpClient() # Один пул HTTP-соединений для REST API и снимков стаканов
+mexc_repository = MexcRepository(http_client) # Репозиторий для API запросов
+symbol_catalogue = SymbolCatalogue(mexc_repository) # Кэш списка пар с индексами для поиска
+market_hub = MarketDataHub(http=http_client, repository=mexc_repository) # Хаб стаканов: одна подписка на символ для всех пользователей
+edit_scheduler = EditScheduler(bot) # Все правки сообщений стакана идут через один планировщик
+metrics_server = metrics.MetricsServer() # Локальный HTTP-адрес метрик в формате Prometheus
+loop_monitor = LoopMonitor() # Монитор цикла событий (задержка, медленные колбэки, /profile)
+
+# Метрики состояния считаются при каждом запросе /metrics
+metrics.ACTIVE_SESSIONS.set_function(lambda: sum(not task.done() for task in parsing_tasks.values()))
+metrics.WS_CONNECTIONS.set_function(lambda: sum(conn["connected"] for conn in market_hub.pool.health()))
+metrics.BOOK_SYMBOLS.set_function(lambda: len(market_hub.book_stats()))
+metrics.BOOK_LEVELS.set_function(lambda: {symbol: stats["levels"] for symbol, stats in market_hub.book_stats().items()})
+metrics.TELEGRAM_EDITS_PENDING.set_function(lambda: edit_scheduler.pending_count)
+metrics.HTTP_REQUESTS.set_function(lambda: dict(http_client.stats))
 
 
 # --- HANDLERS(Обработчики команд и событий)---
@@ -39,24 +67,48 @@ async def cmd_start(message: Message, state: FSMContext):
     if not data:
         await state.set_data(DEFAULT_SETTINGS) # Установка дефолтных настроек, если данных нет
 
-    pairs = await mexc_repository.get_default_symbols() # Получение списка пар
+    pairs = await symbol_catalogue.get_symbols() # Получение списка пар (из кэша каталога)
     
     if not pairs:
         # Попытка повторной загрузки, если не удалось с первого раза
         await message.answer("Загружаю список монет...")
         await asyncio.sleep(1) 
-        pairs = await mexc_repository.get_default_symbols()
+        pairs = await symbol_catalogue.get_symbols()
 
     await message.answer(
         "Привет! Выбери пару для отслеживания стакана:",
         reply_markup=get_pairs_keyboard(pairs, page=0)
     )
 
+@dp.message(Command("profile"))
+async def cmd_profile(message: Message, command: CommandObject):
+    """
+    Служебная команда /profile [сек]: снимает сэмплирующий профиль цикла событий
+    и присылает отчет (задачи и функции, занимающие цикл, задержка цикла,
+    медленные колбэки). Доступна только пользователям из ADMIN_IDS.
+    """
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    try:
+        seconds = float(command.args) if command.args else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        seconds = PROFILE_DEFAULT_SECONDS
+    seconds = min(max(seconds, 1), PROFILE_MAX_SECONDS)
+    if loop_monitor.profiling:
+        await message.answer("⏳ Профилирование уже идет, дождитесь отчета.")
+        return
+
+    await message.answer(f"⏱ Профилирую цикл событий {seconds:.0f} сек...")
+    logging.info(f"Profiling the event loop for {seconds:.0f}s (requested by {message.from_user.id})")
+    report = await loop_monitor.profile(seconds)
+    # Лимит сообщения Telegram - 4096 символов
+    await message.answer(f"```\n{report[:3900]}\n```")
+
 @dp.callback_query(F.data.startswith("page_"), UserStates.choosing_pair)
 async def paginate_pairs(callback: CallbackQuery):
     """Обработка пагинации (кнопки Назад/Далее)."""
     page = int(callback.data.split("_")[1])
-    pairs = await mexc_repository.get_default_symbols() 
+    pairs = await symbol_catalogue.get_symbols()
     
     # Защита от выхода за пределы списка
     if not pairs:
@@ -101,7 +153,7 @@ async def change_settings(callback: CallbackQuery, state: FSMContext):
 async def back_to_pairs(callback: CallbackQuery, state: FSMContext):
     """Возврат из настроек к выбору пары."""
     await state.set_state(UserStates.choosing_pair)
-    pairs = await mexc_repository.get_default_symbols()
+    pairs = await symbol_catalogue.get_symbols()
     await callback.message.edit_text(
         "Выберите валютную пару:",
         reply_markup=get_pairs_keyboard(pairs, page=0)
@@ -121,7 +173,7 @@ async def start_pair_input_handler(callback: CallbackQuery, state: FSMContext):
 async def cancel_input_handler(callback: CallbackQuery, state: FSMContext):
     """Отмена текстового ввода и возврат к списку пар."""
     await state.set_state(UserStates.choosing_pair)
-    pairs = await mexc_repository.get_default_symbols()
+    pairs = await symbol_catalogue.get_symbols()
     await callback.message.edit_text(
         "Вернулись к выбору. Выберите пару:",
         reply_markup=get_pairs_keyboard(pairs, page=0)
@@ -133,14 +185,12 @@ async def process_pair_input_handler(message: Message, state: FSMContext):
     """Обрабатывает текстовый ввод пользователя для поиска пары."""
     user_input = message.text.upper().strip()
 
-    # Используем список рекомендуемых пар для поиска
-    all_pairs = await mexc_repository.get_default_symbols() 
+    # Используем список рекомендуемых пар для поиска (загрузит каталог, если он еще пуст)
+    await symbol_catalogue.get_symbols()
 
-    # Поиск пар, которые начинаются или содержат введенный текст
-    matching_pairs = [
-        p for p in all_pairs 
-        if p.startswith(user_input) or user_input in p
-    ]
+    # Поиск пар, которые начинаются или содержат введенный текст (по индексам каталога).
+    # Больше 11 не нужно: при > 10 совпадениях просим уточнить запрос
+    matching_pairs = symbol_catalogue.search(user_input, limit=11)
 
     if len(matching_pairs) == 1:
         # Найдено одно точное совпадение -> Запускаем парсинг
@@ -168,7 +218,7 @@ async def process_pair_input_handler(message: Message, state: FSMContext):
             symbol,
             interval,
             depth
-        ))
+        ), name=f"parsing_loop:{symbol}")
 
         await state.update_data(current_message_id=msg.message_id, current_symbol=symbol)
         parsing_tasks[user_id] = task
@@ -200,35 +250,55 @@ async def process_pair_input_handler(message: Message, state: FSMContext):
 
 async def parsing_loop(chat_id: int, message_id: int, symbol: str, interval: int, depth: int):
     """
-    Бесконечный цикл, который подключается к WebSocket и периодически
-    обновляет сообщение с данными стакана.
+    Бесконечный цикл, который подписывается на общий стакан символа в хабе и
+    периодически обновляет сообщение с данными стакана. Правки отправляются
+    через общий планировщик EditScheduler (лимиты Telegram, склейка правок).
     """
-    # Создаем и запускаем сервис WebSocket
-    socket_service = MexcSocketService(symbol, None)
-    socket_task = asyncio.create_task(socket_service.start())
+    # Подписываемся на общий стакан (WebSocket открывается только для первого подписчика).
+    # Подписка внутри задачи: задача, отмененная до старта, не оставляет лишнюю подписку
+    socket_service = await market_hub.subscribe(symbol)
+    loop = asyncio.get_running_loop()
+    # Разносим тики сессий по фазе, чтобы правки не уходили одновременно
+    next_tick = loop.time() + edit_scheduler.stagger(interval)
+    edit = None # Future последней поставленной в очередь правки
+    sent_fingerprint = None # Отпечаток текста, который доставлен или уже в очереди
     
     try:
         while True:
-            await asyncio.sleep(interval)  # Пауза между обновлениями
-            data = socket_service.get_latest_data() # Получаем последние данные
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))  # Пауза между обновлениями
+            # Следующий тик по расписанию; пропущенные тики не догоняем
+            next_tick = max(next_tick + interval, loop.time())
+
+            # Проверяем результат предыдущей правки
+            if edit is not None and edit.done() and not edit.cancelled() and edit.exception():
+                error = edit.exception()
+                # Если сообщение не найдено (удалено пользователем или старое), останавливаем
+                if "message to edit not found" in str(error):
+                    raise asyncio.CancelledError
+                logging.error(f"Edit error: {error}")
+                edit = None
+                sent_fingerprint = None # Текст не доставлен - следующую правку отправим в любом случае
+
+            data = socket_service.get_latest_data(depth) # Топ-depth уровней (общий для зрителей с той же глубиной)
             if data and 'asks' in data:
                 text = format_orderbook(symbol, data, depth)
-                try:
-                    # Редактирование сообщения
-                    await bot.edit_message_text(
-                        text=text,
-                        chat_id=chat_id,
-                        message_id=message_id,
-                        reply_markup=get_stop_parsing_keyboard()
-                    )
-                except Exception as e:
-                    if "message is not modified" not in str(e):
-                        # Если сообщение не найдено (удалено пользователем или старое), останавливаем
-                        if "message to edit not found" in str(e):
-                             raise asyncio.CancelledError
-                        logging.error(f"Edit error: {e}")
-            else:
-                pass
+                fingerprint = orderbook_fingerprint(text, EDIT_SKIP_INCLUDE_TIMESTAMP)
+                if fingerprint == sent_fingerprint:
+                    continue # Стакан не изменился - не тратим запрос и лимиты Telegram
+                sent_fingerprint = fingerprint
+                # Возраст данных с момента получения: при постановке правки и (в планировщике) при доставке
+                trace = None
+                if data.get('received_at'):
+                    trace = (socket_service.symbol, data['received_at'])
+                    metrics.DATA_AGE.labels(socket_service.symbol, "submitted").observe(time.time() - data['received_at'])
+                # Ставим правку в очередь планировщика (более старая ожидающая правка заменяется)
+                edit = edit_scheduler.submit(
+                    chat_id,
+                    message_id,
+                    text,
+                    reply_markup=get_stop_parsing_keyboard(),
+                    trace=trace
+                )
                 
     except asyncio.CancelledError:
         logging.info(f"🛑 Parsing task cancelled for {symbol}")
@@ -236,14 +306,11 @@ async def parsing_loop(chat_id: int, message_id: int, symbol: str, interval: int
     except Exception as e:
         logging.error(f"Unexpected error in loop: {e}")
     finally:
-        # Очистка ресурсов при выходе из цикла
-        logging.info(f"Closing socket connection for {symbol}...")
-        await socket_service.stop()
-        socket_task.cancel()
-        try:
-            await socket_task
-        except asyncio.CancelledError:
-            pass
+        # Неотправленная правка больше не нужна
+        edit_scheduler.discard(chat_id, message_id)
+        # Отписка от стакана (соединение закроется, если это был последний подписчик)
+        logging.info(f"Unsubscribing from {symbol} order book...")
+        await market_hub.unsubscribe(symbol)
 
 @dp.callback_query(F.data.startswith("select_"))
 async def start_parsing_pair(callback: CallbackQuery, state: FSMContext):
@@ -280,7 +347,7 @@ async def start_parsing_pair(callback: CallbackQuery, state: FSMContext):
             symbol,
             interval,
             depth
-        ))
+        ), name=f"parsing_loop:{symbol}")
         
         parsing_tasks[user_id] = task
 
@@ -300,7 +367,7 @@ async def stop_parsing_handler(callback: CallbackQuery, state: FSMContext):
     
     
     await state.set_state(UserStates.choosing_pair)
-    pairs = await mexc_repository.get_default_symbols()
+    pairs = await symbol_catalogue.get_symbols()
     
     # Удаляем сообщение стакана и отправляем новое с меню выбора
     try:
@@ -316,13 +383,17 @@ async def stop_parsing_handler(callback: CallbackQuery, state: FSMContext):
 # --- ВОССТАНОВЛЕНИЕ ПОСЛЕ СБОЯ ---
 
 async def on_startup(bot: Bot):
-    """Функция, запускается один раз при старте бота. Восстанавливает активные задачи."""
+    """
+    Функция, запускается один раз при старте бота. Собирает прерванные сессии,
+    группирует их по символам и запускает постепенное восстановление в фоне.
+    """
     logging.info("♻️ Checking for interrupted tasks...")
     
-    # Получаем все данные из нашего JSON-хранилища
-    all_users = storage.get_all_active_users()
+    # Получаем из хранилища только сессии в состоянии парсинга
+    all_users = storage.get_all_active_users(UserStates.parsing.state)
     
-    count = 0
+    # Группируем сессии по символу: {symbol: [(chat_id, user_id, message_id, interval, depth), ...]}
+    sessions_by_symbol = {}
     for key_str, user_info in all_users.items():
         # key_str имеет формат "chat_id:user_id"
         try:
@@ -338,38 +409,103 @@ async def on_startup(bot: Bot):
                 depth = data.get("depth", 5)
                 
                 if symbol and message_id:
-                    logging.info(f"🔄 Restoring task for user {user_id}, pair {symbol}")
-                    
-                    # Отправляем уведомление, что мы вернулись (опционально, можно не делать)
-                    try:
-                        # Пытаемся сразу перезапустить задачу на том же сообщении
-                        task = asyncio.create_task(parsing_loop(
-                            chat_id,
-                            message_id,
-                            symbol,
-                            interval,
-                            depth
-                        ))
-                        parsing_tasks[user_id] = task
-                        count += 1
-                    except Exception as e:
-                        logging.error(f"Failed to restore task for {user_id}: {e}")
+                    sessions_by_symbol.setdefault(symbol, []).append(
+                        (chat_id, user_id, message_id, interval, depth)
+                    )
                         
         except Exception as e:
             logging.error(f"Error parsing user data key {key_str}: {e}")
             
-    if count > 0:
-        logging.info(f"✅ Restored {count} parsing tasks.")
+    if sessions_by_symbol:
+        # Восстанавливаем в фоне, чтобы не задерживать запуск polling
+        asyncio.create_task(restore_sessions(sessions_by_symbol))
     else:
         logging.info("No active tasks to restore.")
 
+async def restore_sessions(sessions_by_symbol):
+    """
+    Постепенно восстанавливает сессии парсинга. Символы берутся из очереди
+    RESTORE_CONCURRENCY обработчиками со случайной задержкой (jitter): стакан
+    каждого символа прогревается один раз (один REST-снимок и одна подписка),
+    после чего сразу запускаются все сессии этого символа.
+    """
+    total_sessions = sum(len(sessions) for sessions in sessions_by_symbol.values())
+    total_symbols = len(sessions_by_symbol)
+    logging.info(f"🔄 Restoring {total_sessions} sessions for {total_symbols} symbols...")
+
+    queue = asyncio.Queue()
+    for item in sessions_by_symbol.items():
+        queue.put_nowait(item)
+    progress = {"symbols": 0, "sessions": 0}
+
+    async def worker():
+        while not queue.empty():
+            symbol, sessions = queue.get_nowait()
+            await asyncio.sleep(random.uniform(0, RESTORE_JITTER)) # Разносим REST-запросы во времени
+            try:
+                await restore_symbol(symbol, sessions, progress)
+            except Exception as e:
+                logging.error(f"Failed to restore sessions for {symbol}: {e}")
+            progress["symbols"] += 1
+            logging.info(
+                f"♻️ Restore progress: {progress['symbols']}/{total_symbols} symbols, "
+                f"{progress['sessions']}/{total_sessions} sessions"
+            )
+
+    await asyncio.gather(*(worker() for _ in range(min(RESTORE_CONCURRENCY, total_symbols))))
+    logging.info(f"✅ Restored {progress['sessions']} parsing tasks.")
+
+async def restore_symbol(symbol, sessions, progress):
+    """Прогревает стакан символа и запускает его сессии на тех же сообщениях."""
+    # Собственная подписка держит стакан открытым, пока сессии подключаются
+    service = await market_hub.subscribe(symbol)
+    try:
+        if not await service.wait_ready(RESTORE_WARMUP_TIMEOUT):
+            logging.warning(f"Order book for {symbol} is not ready yet, restoring sessions anyway")
+        for chat_id, user_id, message_id, interval, depth in sessions:
+            if user_id in parsing_tasks:
+                continue # Пользователь уже запустил новую сессию после старта бота
+            logging.info(f"🔄 Restoring task for user {user_id}, pair {symbol}")
+            # Перезапускаем задачу на том же сообщении
+            task = asyncio.create_task(parsing_loop(
+                chat_id,
+                message_id,
+                symbol,
+                interval,
+                depth
+            ), name=f"parsing_loop:{symbol}")
+            parsing_tasks[user_id] = task
+            progress["sessions"] += 1
+        # Даем созданным задачам оформить свои подписки, чтобы стакан не закрылся между ними
+        await asyncio.sleep(0)
+    finally:
+        await market_hub.unsubscribe(symbol)
+
+async def on_shutdown(bot: Bot):
+    """
+    Функция, запускается при остановке бота. Закрывает все общие стаканы и
+    планировщик правок. Хранилище FSM закрывает сам диспетчер (fsm.close),
+    его close() сбрасывает на диск отложенные изменения.
+    """
+    await edit_scheduler.stop()
+    await loop_monitor.stop()
+    await metrics_server.stop()
+    await symbol_catalogue.stop()
+    await market_hub.close()
+    await http_client.close()
+
 async def main():
     """Основная функция запуска бота."""
-    async with mexc_repository:
-        await mexc_repository.get_default_symbols() # Предварительная загрузка символов
-
-    # Регистрация функции восстановления при старте
+    await symbol_catalogue.refresh() # Предварительная загрузка символов
+    symbol_catalogue.start() # Фоновое обновление списка раз в SYMBOLS_REFRESH_INTERVAL
+    if METRICS_ENABLED:
+        await metrics_server.start() # http://METRICS_HOST:METRICS_PORT/metrics
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start() # Задержка цикла событий и медленные колбэки (с именами задач)
+
+    # Регистрация функции восстановления при старте и закрытия стаканов при остановке
     dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
 
     logging.info("Bot started")
     # Запуск бота (бесконечный цикл обработки событий)
@@ -379,6 +515,4 @@ if __name__ == "__main__":
     try:
         asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
-        logging.info("Bot stopped")
-    finally:
-        asyncio.run(mexc_repository._close_session())
\ No newline at end of file
+        logging.info("Bot stopped")
\ No newline at end of file
@@ -0,0 +1,65 @@
+# services/backoff.py
+import random
+import time
+
+from config import (
+    WS_BACKOFF_BASE, WS_BACKOFF_CAP,
+    WS_CIRCUIT_BREAKER_THRESHOLD, WS_CIRCUIT_BREAKER_COOLDOWN
+)
+
+
+class ExponentialBackoff:
+    """
+    Экспоненциальная задержка с полным джиттером (full jitter):
+    delay = random(0, min(cap, base * 2 ** attempt)).
+    Случайная задержка не дает сотням соединений переподключаться синхронно.
+    """
+    def __init__(self, base: float = WS_BACKOFF_BASE, cap: float = WS_BACKOFF_CAP):
+        self.base = base
+        self.cap = cap
+        self.attempt = 0
+
+    def next_delay(self) -> float:
+        """Задержка перед следующей попыткой (увеличивает счетчик попыток)."""
+        delay = random.uniform(0, min(self.cap, self.base * (2 ** self.attempt)))
+        self.attempt += 1
+        return delay
+
+    def reset(self):
+        """Сбрасывает задержку после успешной работы."""
+        self.attempt = 0
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: после threshold неудач подряд размыкается на cooldown секунд,
+    в течение которых попытки переподключения не выполняются.
+    """
+    def __init__(self, threshold: int = WS_CIRCUIT_BREAKER_THRESHOLD,
+                 cooldown: float = WS_CIRCUIT_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0 # Неудач подряд
+        self.opened_until = 0.0 # До какого момента разомкнут (time.monotonic)
+        self.trips = 0 # Сколько раз размыкался
+
+    @property
+    def is_open(self) -> bool:
+        return self.remaining() > 0
+
+    def remaining(self) -> float:
+        """Сколько секунд предохранитель еще разомкнут (0 - замкнут)."""
+        return max(0.0, self.opened_until - time.monotonic())
+
+    def record_success(self):
+        self.failures = 0
+
+    def record_failure(self) -> bool:
+        """Учитывает неудачу. Возвращает True, если предохранитель только что разомкнулся."""
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.failures = 0
+            self.opened_until = time.monotonic() + self.cooldown
+            self.trips += 1
+            return True
+        return False
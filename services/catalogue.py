@@ -0,0 +1,171 @@
+# services/catalogue.py
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+from services.repository import MexcRepository # REST-источник списка пар
+from services.backoff import ExponentialBackoff # Задержка между повторами после неудачной загрузки
+from config import SYMBOLS_REFRESH_INTERVAL
+
+# Максимальная длина n-грамм в индексе. Подстроки длиной до NGRAM_SIZE ищутся
+# прямо по индексу, более длинные - пересечением индексов их триграмм.
+NGRAM_SIZE = 3
+# Первая задержка повтора после неудачного обновления каталога (сек); дальше растет до ttl
+REFRESH_RETRY_BASE = 5.0
+
+
+class SymbolCatalogue:
+    """
+    Кэшированный каталог торговых пар с индексами для поиска.
+
+    Список загружается один раз и обновляется в фоне раз в ttl секунд
+    (stale-while-revalidate: пока идет обновление, отдается старый список).
+    Для поиска строятся отсортированный массив (поиск по префиксу через bisect)
+    и n-граммный индекс (поиск по подстроке без перебора всего списка).
+    """
+    def __init__(self, repository: MexcRepository, ttl: float = SYMBOLS_REFRESH_INTERVAL):
+        self.repository = repository
+        self.ttl = ttl
+        self._symbols: List[str] = [] # Пары в порядке API
+        self._sorted: List[str] = [] # Пары по алфавиту (для префиксного поиска)
+        self._ngrams: Dict[str, List[int]] = {} # {n-грамма: индексы пар в _symbols по возрастанию}
+        self._loaded_at: Optional[float] = None # Время последней успешной загрузки (time.monotonic, None - не загружен)
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None # Разовое фоновое обновление
+        self._loop_task: Optional[asyncio.Task] = None # Периодическое обновление
+
+    @property
+    def is_stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    async def get_symbols(self) -> List[str]:
+        """
+        Возвращает список пар. Первый вызов ждет загрузку, дальше отдается кэш;
+        устаревший кэш обновляется в фоне, не задерживая пользователя.
+        """
+        if not self._symbols:
+            await self.refresh()
+        elif self.is_stale:
+            self._schedule_refresh()
+        return self._symbols
+
+    async def refresh(self) -> bool:
+        """
+        Загружает список пар и перестраивает индексы. При ошибке остается старый список.
+        Возвращает True, если список обновлен.
+        """
+        async with self._lock:
+            symbols = await self.repository.get_default_symbols()
+            if not symbols:
+                logging.warning("Symbol catalogue refresh failed, keeping cached list")
+                return False
+            self._build_index(symbols)
+            self._loaded_at = time.monotonic()
+            logging.info(f"Symbol catalogue loaded: {len(symbols)} pairs")
+            return True
+
+    def _schedule_refresh(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self.refresh())
+
+    def start(self):
+        """Запускает периодическое фоновое обновление каталога."""
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        for task in (self._loop_task, self._refresh_task):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+    async def _refresh_loop(self):
+        backoff = ExponentialBackoff(REFRESH_RETRY_BASE, max(REFRESH_RETRY_BASE, self.ttl))
+        retry_at: Optional[float] = None # Срок повтора после неудачи (time.monotonic)
+        while True:
+            if retry_at is not None:
+                deadline = retry_at
+            elif self._loaded_at is not None:
+                deadline = self._loaded_at + self.ttl
+            else:
+                deadline = time.monotonic() # Каталог еще не загружен - обновляем сразу
+            await asyncio.sleep(max(1.0, deadline - time.monotonic()))
+            try:
+                ok = await self.refresh()
+            except Exception as e:
+                logging.error(f"Symbol catalogue refresh error: {e}")
+                ok = False
+            if ok:
+                backoff.reset()
+                retry_at = None
+            else:
+                # _loaded_at не меняется при неудаче - без отдельного срока цикл повторял бы раз в секунду
+                retry_at = time.monotonic() + backoff.next_delay()
+
+    def _build_index(self, symbols: List[str]):
+        """Строит отсортированный массив и n-граммный индекс. Новые структуры подменяются разом."""
+        ngrams: Dict[str, List[int]] = {}
+        for idx, symbol in enumerate(symbols):
+            seen = set()
+            for n in range(1, NGRAM_SIZE + 1):
+                for i in range(len(symbol) - n + 1):
+                    gram = symbol[i:i + n]
+                    if gram not in seen:
+                        seen.add(gram)
+                        ngrams.setdefault(gram, []).append(idx)
+        self._symbols = list(symbols)
+        self._sorted = sorted(symbols)
+        self._ngrams = ngrams
+
+    def search_prefix(self, query: str, limit: Optional[int] = None) -> List[str]:
+        """Пары, начинающиеся с query (по алфавиту). O(log n + k)."""
+        query = query.upper()
+        start = bisect_left(self._sorted, query)
+        result = []
+        for symbol in self._sorted[start:]:
+            if not symbol.startswith(query) or (limit is not None and len(result) >= limit):
+                break
+            result.append(symbol)
+        return result
+
+    def _contains_indexes(self, query: str) -> List[int]:
+        """Индексы пар, содержащих query, по n-граммному индексу."""
+        if len(query) <= NGRAM_SIZE:
+            return self._ngrams.get(query, [])
+        # Пересекаем индексы триграмм запроса, начиная с самого короткого
+        postings = sorted(
+            (self._ngrams.get(query[i:i + NGRAM_SIZE], []) for i in range(len(query) - NGRAM_SIZE + 1)),
+            key=len
+        )
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                return []
+        # Триграммы могут совпасть в разных местах - проверяем подстроку
+        return sorted(i for i in candidates if query in self._symbols[i])
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[str]:
+        """
+        Пары, содержащие query: сначала совпадения по префиксу (по алфавиту),
+        затем остальные вхождения в порядке каталога. limit ограничивает результат.
+        """
+        query = query.upper().strip()
+        if not query:
+            return []
+        result = self.search_prefix(query, limit)
+        if limit is not None and len(result) >= limit:
+            return result
+        for idx in self._contains_indexes(query):
+            symbol = self._symbols[idx]
+            if symbol.startswith(query):
+                continue # Уже в результате из префиксного поиска
+            result.append(symbol)
+            if limit is not None and len(result) >= limit:
+                break
+        return result
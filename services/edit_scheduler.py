@@ -0,0 +1,280 @@
+# services/edit_scheduler.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest
+
+from services.metrics import TELEGRAM_EDIT_SECONDS, TELEGRAM_EDITS, TELEGRAM_EDIT_ERRORS, DATA_AGE # Метрики правок
+from config import TELEGRAM_GLOBAL_RATE, TELEGRAM_PER_CHAT_RATE, TELEGRAM_MAX_IN_FLIGHT
+
+# Результаты доставки правки (значение future из EditScheduler.submit)
+EDIT_SENT = "sent" # Сообщение отредактировано
+EDIT_NOT_MODIFIED = "not_modified" # Telegram ответил "message is not modified"
+EDIT_SUPERSEDED = "superseded" # Правку заменила более новая для того же сообщения
+
+# Шаг фазы для равномерного разнесения сессий (дробная часть золотого сечения)
+_GOLDEN_RATIO_STEP = 0.6180339887498949
+
+
+def _retrieve_exception(future: asyncio.Future):
+    """
+    Помечает исключение правки полученным: сессия могла завершиться или сменить
+    future до ответа Telegram, и иначе asyncio пишет "Future exception was never retrieved".
+    """
+    if not future.cancelled():
+        future.exception()
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity в запасе."""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен один токен (0 - уже доступен)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _PendingEdit:
+    """Отложенная правка одного сообщения."""
+    __slots__ = ("chat_id", "message_id", "text", "reply_markup", "future", "trace")
+
+    def __init__(self, chat_id: int, message_id: int, text: str, reply_markup, future: asyncio.Future,
+                 trace: Optional[Tuple[str, float]] = None):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+        self.reply_markup = reply_markup
+        self.future = future
+        self.trace = trace # (символ, время получения показанных данных) для метрики возраста данных
+
+
+class EditScheduler:
+    """
+    Единый планировщик всех исходящих правок сообщений (edit_message_text).
+
+    - Соблюдает глобальный лимит Telegram и лимит на чат (token bucket).
+    - Учитывает retry_after из ответа 429: отправка приостанавливается, правка
+      возвращается в начало очереди.
+    - Склеивает ожидающие правки одного сообщения: отправляется только последний текст.
+    - Выдает сессиям фазы (stagger), чтобы их тики были разнесены во времени,
+      а не срабатывали одновременно.
+    """
+    def __init__(self, bot: Bot, global_rate: float = TELEGRAM_GLOBAL_RATE,
+                 per_chat_rate: float = TELEGRAM_PER_CHAT_RATE,
+                 max_in_flight: int = TELEGRAM_MAX_IN_FLIGHT):
+        self.bot = bot
+        self.per_chat_rate = per_chat_rate
+        self._global = TokenBucket(global_rate)
+        self._chats: Dict[int, TokenBucket] = {} # {chat_id: bucket}
+        # Очередь правок в порядке первой постановки: {(chat_id, message_id): правка}
+        self._pending: "OrderedDict[Tuple[int, int], _PendingEdit]" = OrderedDict()
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._in_flight_keys: Set[Tuple[int, int]] = set() # Сообщения, правка которых сейчас отправляется
+        self._send_tasks: Set[asyncio.Task] = set() # Задачи отправки (цикл хранит задачи лишь по слабой ссылке)
+        self._wakeup = asyncio.Event()
+        self._paused_until = 0.0 # Пауза после 429 (time.monotonic)
+        self._phase = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._last_prune = time.monotonic()
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def start(self):
+        """Запускает фоновую задачу отправки (вызывается автоматически при первой правке)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._worker(), name="edit_scheduler")
+
+    async def stop(self):
+        """Останавливает отправку. Ожидающие правки отменяются."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for edit in self._pending.values():
+            edit.future.cancel()
+        self._pending.clear()
+
+    def stagger(self, interval: float) -> float:
+        """
+        Возвращает сдвиг первого тика сессии в пределах interval. Последовательные
+        вызовы дают равномерно распределенные фазы (последовательность золотого сечения).
+        """
+        self._phase = (self._phase + _GOLDEN_RATIO_STEP) % 1.0
+        return self._phase * interval
+
+    def submit(self, chat_id: int, message_id: int, text: str, reply_markup=None,
+               trace: Optional[Tuple[str, float]] = None) -> asyncio.Future:
+        """
+        Ставит правку сообщения в очередь. Если для сообщения уже есть ожидающая
+        правка, она заменяется (побеждает последний текст), а ее future получает
+        EDIT_SUPERSEDED. Возвращает future с результатом EDIT_* или исключением Telegram.
+        trace - (символ, время получения данных стакана): при доставке правки ее
+        возраст попадает в метрику orderbook_data_age_seconds{stage="delivered"}.
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_retrieve_exception) # Ошибку правки могут и не прочитать
+        key = (chat_id, message_id)
+        old = self._pending.get(key)
+        if old is not None:
+            # Сохраняем место в очереди, меняем только содержимое
+            if not old.future.done():
+                old.future.set_result(EDIT_SUPERSEDED)
+            old.text, old.reply_markup, old.future, old.trace = text, reply_markup, future, trace
+        else:
+            self._pending[key] = _PendingEdit(chat_id, message_id, text, reply_markup, future, trace)
+        self._wakeup.set()
+        return future
+
+    def discard(self, chat_id: int, message_id: int):
+        """Убирает ожидающую правку сообщения (например, при остановке сессии)."""
+        edit = self._pending.pop((chat_id, message_id), None)
+        if edit is not None:
+            edit.future.cancel()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.per_chat_rate)
+        return bucket
+
+    def _prune_buckets(self, now: float):
+        """Удаляет полные (давно неиспользуемые) корзины чатов, чтобы словарь не рос."""
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        for chat_id in [c for c, b in self._chats.items() if b.is_full(now)]:
+            del self._chats[chat_id]
+
+    def _pick(self, now: float) -> Tuple[Optional[_PendingEdit], float]:
+        """
+        Первая по очереди правка, чей чат не исчерпал лимит, либо минимальное время ожидания.
+        Сообщения с правкой в пути пропускаются: новый текст не должен обогнать старый.
+        """
+        min_wait = float("inf")
+        for key, edit in self._pending.items():
+            if key in self._in_flight_keys:
+                continue # Дождемся ответа на предыдущую правку (_send разбудит цикл)
+            wait = self._chat_bucket(edit.chat_id).delay(now)
+            if wait <= 0:
+                del self._pending[key]
+                return edit, 0.0
+            min_wait = min(min_wait, wait)
+        return None, min_wait
+
+    async def _sleep(self, timeout: float):
+        """Спит до timeout или до новой правки в очереди."""
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _worker(self):
+        """Фоновый цикл: выбирает правки с учетом лимитов и отправляет их."""
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Слот отправки занимаем до выбора правки: пока ждем слот, текст в очереди может смениться
+            await self._in_flight.acquire()
+            now = time.monotonic()
+            self._prune_buckets(now)
+            edit = None
+            wait = max(self._paused_until - now, self._global.delay(now))
+            if wait <= 0:
+                edit, wait = self._pick(now)
+            if edit is None:
+                self._in_flight.release()
+                await self._sleep(wait)
+                continue
+
+            self._global.consume(now)
+            self._chat_bucket(edit.chat_id).consume(now)
+            self._in_flight_keys.add((edit.chat_id, edit.message_id))
+            task = asyncio.create_task(self._send(edit), name="telegram_edit")
+            self._send_tasks.add(task)
+            task.add_done_callback(self._send_tasks.discard)
+
+    async def _send(self, edit: _PendingEdit):
+        """Отправляет одну правку и разрешает ее future."""
+        started = time.monotonic()
+        try:
+            await self.bot.edit_message_text(
+                text=edit.text,
+                chat_id=edit.chat_id,
+                message_id=edit.message_id,
+                reply_markup=edit.reply_markup
+            )
+            result = EDIT_SENT
+        except TelegramRetryAfter as e:
+            TELEGRAM_EDIT_ERRORS.labels(type(e).__name__).inc()
+            # Флуд-контроль: приостанавливаем все отправки и возвращаем правку в начало очереди
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            logging.warning(f"Telegram flood control: pausing edits for {e.retry_after}s (chat {edit.chat_id})")
+            key = (edit.chat_id, edit.message_id)
+            if key in self._pending:
+                # Пока ждали ответа, пришел более новый текст - старый не нужен
+                result = EDIT_SUPERSEDED
+            elif edit.future.cancelled():
+                return
+            else:
+                self._pending[key] = edit
+                self._pending.move_to_end(key, last=False)
+                return
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                TELEGRAM_EDIT_ERRORS.labels(type(e).__name__).inc()
+                if not edit.future.done():
+                    edit.future.set_exception(e)
+                return
+            result = EDIT_NOT_MODIFIED
+        except Exception as e:
+            TELEGRAM_EDIT_ERRORS.labels(type(e).__name__).inc()
+            if not edit.future.done():
+                edit.future.set_exception(e)
+            return
+        finally:
+            TELEGRAM_EDIT_SECONDS.observe(time.monotonic() - started)
+            self._in_flight_keys.discard((edit.chat_id, edit.message_id))
+            self._in_flight.release()
+            self._wakeup.set()
+
+        TELEGRAM_EDITS.labels(result).inc()
+        if edit.trace is not None and result != EDIT_SUPERSEDED:
+            symbol, received_at = edit.trace
+            DATA_AGE.labels(symbol, "delivered").observe(time.time() - received_at)
+        if not edit.future.done():
+            edit.future.set_result(result)
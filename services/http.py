@@ -0,0 +1,84 @@
+# services/http.py
+import aiohttp # Библиотека для асинхронных HTTP-запросов
+import logging
+from typing import Dict, Optional
+
+from config import (
+    HTTP_POOL_LIMIT, HTTP_LIMIT_PER_HOST, HTTP_TIMEOUT,
+    HTTP_DNS_CACHE_TTL, HTTP_KEEPALIVE_TIMEOUT
+)
+
+
+class HttpClient:
+    """
+    Общий HTTP-клиент процесса поверх одной aiohttp.ClientSession.
+    Пул соединений с keep-alive, кэшем DNS, лимитом соединений на хост и
+    таймаутом запросов. Используется и REST-репозиторием, и загрузкой снимков
+    стаканов, поэтому повторные запросы не платят за новое TCP+TLS рукопожатие.
+    Считает запросы, новые и переиспользованные соединения.
+    """
+    def __init__(self, limit: int = HTTP_POOL_LIMIT, limit_per_host: int = HTTP_LIMIT_PER_HOST,
+                 timeout: float = HTTP_TIMEOUT):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.stats: Dict[str, int] = {
+            "requests": 0, # Всего запросов
+            "connections_created": 0, # Новых соединений (рукопожатий)
+            "connections_reused": 0, # Запросов через соединение из пула
+            "errors": 0, # Сетевых ошибок
+        }
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        """Хуки aiohttp для счетчиков переиспользования пула."""
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            self.stats["requests"] += 1
+
+        async def on_connection_create_end(session, ctx, params):
+            self.stats["connections_created"] += 1
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self.stats["connections_reused"] += 1
+
+        async def on_request_exception(session, ctx, params):
+            self.stats["errors"] += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace.on_request_exception.append(on_request_exception)
+        return trace
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Сессия создается при первом запросе (нужен запущенный цикл событий)."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={
+                    "User-Agent": "Mozilla/5.0 (Custom MEXC Bot)"
+                },
+                trace_configs=[self._trace_config()]
+            )
+        return self._session
+
+    def get(self, url: str, **kwargs):
+        """GET-запрос через общий пул. Используется как `async with http.get(...) as resp`."""
+        return self.session.get(url, **kwargs)
+
+    async def close(self):
+        """Закрывает сессию и все соединения пула."""
+        if self._session and not self._session.closed:
+            await self._session.close()
+            logging.info(f"HTTP client closed: {self.stats}")
+        self._session = None
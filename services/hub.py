@@ -0,0 +1,99 @@
+# services/hub.py
+import asyncio
+import logging
+from typing import Dict, Any, Optional
+
+from services.socket import MexcSocketService # Сервис стакана одного символа
+from services.pool import MexcConnectionPool # Пул WebSocket-соединений для всех символов
+from services.http import HttpClient # Общий HTTP-клиент для REST-снимков
+from services.repository import MexcRepository # Точность цен символов (exchangeInfo)
+
+
+class MarketDataHub:
+    """
+    Общий для всего процесса хаб рыночных данных.
+    Держит ровно один стакан (MexcSocketService) на символ и считает количество
+    подписчиков. Стакан создается при первой подписке и закрывается, когда
+    уходит последний подписчик. Обновления всех стаканов приходят через общий
+    пул WebSocket-соединений.
+    """
+    def __init__(self, pool: Optional[MexcConnectionPool] = None, http: Optional[HttpClient] = None,
+                 repository: Optional[MexcRepository] = None):
+        self.pool = pool or MexcConnectionPool() # Общий пул соединений
+        self._owns_http = http is None # Собственный клиент закрываем сами, общий - владелец
+        self.http = http or HttpClient()
+        self.repository = repository # Точность цен для стаканов (None - определяется по данным)
+        self._services: Dict[str, MexcSocketService] = {} # {symbol: сервис стакана}
+        self._tasks: Dict[str, asyncio.Task] = {} # {symbol: задача загрузки снимка и подписки}
+        self._refcounts: Dict[str, int] = {} # {symbol: количество подписчиков}
+        self._lock = asyncio.Lock() # Защита от гонок при подписке/отписке
+
+    @staticmethod
+    def _normalize(symbol: str) -> str:
+        # Та же нормализация тикера, что и в MexcSocketService
+        return symbol.replace("/", "").upper()
+
+    async def subscribe(self, symbol: str) -> MexcSocketService:
+        """Подписывает сессию на стакан символа. Возвращает общий сервис стакана."""
+        symbol = self._normalize(symbol)
+        async with self._lock:
+            service = self._services.get(symbol)
+            if service is None:
+                service = MexcSocketService(symbol, None, self.pool, self.http, self.repository)
+                self._services[symbol] = service
+                self._tasks[symbol] = asyncio.create_task(service.start(), name=f"orderbook:{symbol}")
+                self._refcounts[symbol] = 0
+                logging.info(f"Hub: order book opened for {symbol}")
+            self._refcounts[symbol] += 1
+            return service
+
+    async def unsubscribe(self, symbol: str):
+        """Отписывает сессию. Последний подписчик закрывает стакан символа."""
+        symbol = self._normalize(symbol)
+        async with self._lock:
+            if symbol not in self._refcounts:
+                return
+            self._refcounts[symbol] -= 1
+            if self._refcounts[symbol] > 0:
+                return
+            service = self._services.pop(symbol)
+            task = self._tasks.pop(symbol)
+            del self._refcounts[symbol]
+
+        # Отписываемся вне блокировки, чтобы не задерживать другие символы
+        logging.info(f"Hub: last subscriber left, closing order book for {symbol}")
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        await service.stop()
+
+    def get_latest_data(self, symbol: str, depth: int = 50) -> Optional[Dict[str, Any]]:
+        """Возвращает топ-depth уровней стакана символа (или None, если стакан не открыт)."""
+        service = self._services.get(self._normalize(symbol))
+        return service.get_latest_data(depth) if service else None
+
+    def book_stats(self) -> Dict[str, Dict[str, int]]:
+        """Размер стаканов по символам: уровни в памяти и отброшенные политикой хранения."""
+        return {
+            symbol: {"levels": service.book.size, "pruned": service.book.pruned}
+            for symbol, service in self._services.items()
+        }
+
+    def subscriber_count(self, symbol: str) -> int:
+        """Количество активных подписчиков символа."""
+        return self._refcounts.get(self._normalize(symbol), 0)
+
+    async def close(self):
+        """Закрывает все открытые стаканы, соединения пула и собственный HTTP-клиент (при остановке бота)."""
+        async with self._lock:
+            symbols = list(self._services)
+            for symbol in symbols:
+                # Сбрасываем счетчик, чтобы unsubscribe закрыл стакан сразу
+                self._refcounts[symbol] = 1
+        for symbol in symbols:
+            await self.unsubscribe(symbol)
+        await self.pool.close()
+        if self._owns_http:
+            await self.http.close()
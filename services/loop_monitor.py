@@ -0,0 +1,219 @@
+# services/loop_monitor.py
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, Optional
+
+from services.metrics import LOOP_LAG_SECONDS, LOOP_SLOW_CALLBACKS, LOOP_SLOW_CALLBACK_SECONDS
+from config import (
+    LOOP_LAG_INTERVAL, LOOP_SLOW_CALLBACK_MS, PROFILE_SAMPLE_INTERVAL_MS
+)
+
+# Сколько последних замеров задержки цикла хранить для отчета (/profile)
+LAG_HISTORY = 600
+# Как часто повторять предупреждение о медленных колбэках одной задачи (сек)
+SLOW_LOG_INTERVAL = 10.0
+# Сколько кадров стека учитывать в профиле (от самого внутреннего)
+PROFILE_STACK_DEPTH = 30
+# Сколько строк выводить в каждом разделе отчета профиля
+PROFILE_TOP = 12
+
+
+def describe_handle(handle) -> str:
+    """
+    Имя того, кто выполняется в колбэке цикла событий: имя задачи (если задано
+    при create_task, например "parsing_loop:BTCUSDT"), иначе имя корутины задачи,
+    иначе имя самого колбэка.
+    """
+    callback = getattr(handle, "_callback", None)
+    owner = getattr(callback, "__self__", None)
+    if isinstance(owner, asyncio.Task):
+        name = owner.get_name()
+        if not name.startswith("Task-"): # Имя по умолчанию ничего не говорит
+            return name
+        coro = owner.get_coro()
+        return getattr(coro, "__qualname__", None) or repr(coro)
+    return getattr(callback, "__qualname__", None) or repr(callback)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class LoopMonitor:
+    """
+    Монитор цикла событий:
+    - непрерывно измеряет задержку цикла (насколько позже запланированного
+      просыпается sleep) - метрика event_loop_lag_seconds;
+    - замеряет каждый колбэк цикла (обертка asyncio.Handle._run, как в режиме
+      отладки asyncio) и считает/логирует колбэки дольше порога с именем задачи;
+    - по запросу снимает сэмплирующий профиль: отдельный поток периодически
+      читает стек потока цикла и текущую задачу.
+    """
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, slow_callback_ms: float = LOOP_SLOW_CALLBACK_MS):
+        self.interval = interval
+        self.slow_threshold = slow_callback_ms / 1000
+        self.lags: Deque[float] = deque(maxlen=LAG_HISTORY) # Последние замеры задержки (сек)
+        self.slow_callbacks: Counter = Counter() # {имя задачи: число медленных колбэков}
+        self.profiling = False
+        self._task: Optional[asyncio.Task] = None
+        self._thread_id: Optional[int] = None
+        self._original_run = None
+        self._current = None # Выполняемый сейчас колбэк (Handle) - для профиля
+        self._slow_logged_at: Dict[str, float] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Запускает измерение задержки и замер колбэков (вызывается из работающего цикла)."""
+        if self.running:
+            return
+        self._thread_id = threading.get_ident()
+        self._install()
+        self._task = asyncio.create_task(self._measure_lag(), name="loop_monitor")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._uninstall()
+
+    def _install(self):
+        """Оборачивает asyncio.Handle._run: время каждого колбэка и текущий колбэк для профиля."""
+        if self._original_run is not None:
+            return
+        original = self._original_run = asyncio.events.Handle._run
+        monitor = self
+        clock = time.perf_counter
+
+        def _run(handle):
+            monitor._current = handle
+            started = clock()
+            try:
+                return original(handle)
+            finally:
+                elapsed = clock() - started
+                monitor._current = None
+                if elapsed >= monitor.slow_threshold:
+                    monitor._on_slow_callback(handle, elapsed)
+
+        asyncio.events.Handle._run = _run
+
+    def _uninstall(self):
+        if self._original_run is not None:
+            asyncio.events.Handle._run = self._original_run
+            self._original_run = None
+
+    def _on_slow_callback(self, handle, elapsed: float):
+        name = describe_handle(handle)
+        self.slow_callbacks[name] += 1
+        LOOP_SLOW_CALLBACKS.labels(name).inc()
+        LOOP_SLOW_CALLBACK_SECONDS.observe(elapsed)
+        # Одна задача может тормозить на каждом тике - не заваливаем лог
+        now = time.monotonic()
+        if now - self._slow_logged_at.get(name, 0.0) >= SLOW_LOG_INTERVAL:
+            self._slow_logged_at[name] = now
+            logging.warning(
+                f"Slow callback: {name} blocked the event loop for {elapsed * 1000:.0f}ms "
+                f"({self.slow_callbacks[name]} times so far)"
+            )
+
+    async def _measure_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.lags.append(lag)
+            LOOP_LAG_SECONDS.observe(lag)
+
+    def lag_summary(self) -> Dict[str, Optional[float]]:
+        """p50/p99/max задержки цикла по последним замерам (мс)."""
+        if not self.lags:
+            return {"p50": None, "p99": None, "max": None}
+        values = sorted(self.lags)
+        pick = lambda q: round(values[min(len(values) - 1, int(q * (len(values) - 1)))] * 1000, 1)
+        return {"p50": pick(0.50), "p99": pick(0.99), "max": round(values[-1] * 1000, 1)}
+
+    def _sample(self, duration: float, interval: float) -> Dict:
+        """Поток профилировщика: сэмплы стека потока цикла и текущей задачи."""
+        tasks, own, total = Counter(), Counter(), Counter()
+        samples = busy = 0
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self._thread_id)
+            handle = self._current
+            samples += 1
+            if frame is not None and handle is not None:
+                busy += 1
+                tasks[describe_handle(handle)] += 1
+                seen = set()
+                for depth in range(PROFILE_STACK_DEPTH):
+                    if frame is None:
+                        break
+                    name = _frame_name(frame)
+                    if depth == 0:
+                        own[name] += 1
+                    if name not in seen: # Рекурсия не должна считаться дважды
+                        seen.add(name)
+                        total[name] += 1
+                    frame = frame.f_back
+            time.sleep(interval)
+        return {"samples": samples, "busy": busy, "tasks": tasks, "own": own, "total": total}
+
+    async def profile(self, duration: float, interval_ms: float = PROFILE_SAMPLE_INTERVAL_MS) -> str:
+        """Снимает профиль цикла событий за duration секунд и возвращает текстовый отчет."""
+        if self.profiling:
+            raise RuntimeError("Profiling is already running")
+        if self._thread_id is None:
+            self._thread_id = threading.get_ident()
+        installed = self._original_run is None
+        if installed:
+            self._install() # Без обертки не видно текущую задачу
+        self.profiling = True
+        try:
+            result = await asyncio.to_thread(self._sample, duration, interval_ms / 1000)
+        finally:
+            self.profiling = False
+            if installed and not self.running:
+                self._uninstall()
+        return self._format_report(duration, result)
+
+    def _format_report(self, duration: float, result: Dict) -> str:
+        samples, busy = result["samples"], result["busy"]
+
+        def section(title: str, counter: Counter, base: int):
+            lines = [title]
+            for name, count in counter.most_common(PROFILE_TOP):
+                lines.append(f"{count / base:6.1%}  {name}")
+            return lines
+
+        lines = [
+            f"Profile {duration:.0f}s, {samples} samples, loop busy {busy / max(samples, 1):.0%}",
+        ]
+        if busy:
+            lines.append("")
+            lines.extend(section("Tasks (share of busy time):", result["tasks"], busy))
+            lines.append("")
+            lines.extend(section("Functions, self:", result["own"], busy))
+            lines.append("")
+            lines.extend(section("Functions, total:", result["total"], busy))
+        lag = self.lag_summary()
+        lines.append("")
+        lines.append(f"Loop lag ms: p50 {lag['p50']}, p99 {lag['p99']}, max {lag['max']}")
+        if self.slow_callbacks:
+            lines.append(f"Slow callbacks (>{self.slow_threshold * 1000:.0f}ms):")
+            for name, count in self.slow_callbacks.most_common(PROFILE_TOP):
+                lines.append(f"{count:6d}  {name}")
+        return "\n".join(lines)
@@ -0,0 +1,304 @@
+# services/metrics.py
+import bisect
+import logging
+import math
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+
+from config import METRICS_HOST, METRICS_PORT
+
+# Границы гистограмм горячего пути (декодирование, дельта, отрисовка): от 10 мкс до 100 мс
+FAST_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+# Границы гистограмм сетевых запросов (Telegram Bot API): от 50 мс до 10 с
+NETWORK_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Границы гистограмм возраста данных (биржа -> бот -> Telegram): от 10 мс до 60 с
+AGE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Границы гистограмм задержки цикла событий и медленных колбэков: от 1 мс до 5 с
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    """
+    Общая часть метрик: имя, описание, имена меток и дочерние значения по
+    значениям меток. Метрику без меток можно использовать напрямую (inc/set/observe),
+    метрику с метками - через labels(...), который кэширует дочерний объект.
+    """
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._function: Optional[Callable] = None
+        if not self.labelnames:
+            # Метрика без меток выводится сразу (с нулевым значением), а не после первого события
+            self._children[()] = self._new_child()
+
+    def labels(self, *values):
+        """Дочернее значение для набора значений меток (в порядке labelnames)."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def set_function(self, function: Callable):
+        """
+        Значение вычисляется при сборе метрик: function() возвращает число (метрика
+        без меток) или словарь {значение метки или кортеж значений: число}.
+        """
+        self._function = function
+
+    def remove(self, *values):
+        """Удаляет дочернее значение (например, символ закрытого стакана)."""
+        self._children.pop(values, None)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        # Метрика без меток - единственное дочернее значение с пустым ключом
+        return self._children[()]
+
+    def _label_text(self, values: Tuple[str, ...], extra: Iterable[Tuple[str, str]] = ()) -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, values)]
+        pairs.extend(f'{name}="{value}"' for name, value in extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def _samples(self) -> List[Tuple[Tuple[str, ...], float]]:
+        if self._function is None:
+            return [(values, child.value) for values, child in list(self._children.items())]
+        result = self._function()
+        if not isinstance(result, dict):
+            return [((), float(result))]
+        return [
+            (values if isinstance(values, tuple) else (values,), float(value))
+            for values, value in result.items()
+        ]
+
+    def expose(self) -> List[str]:
+        """Строки метрики в текстовом формате Prometheus."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, value in self._samples():
+            lines.append(f"{self.name}{self._label_text(values)} {_format_value(value)}")
+        return lines
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    """Монотонный счетчик."""
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    """Текущее значение (может уменьшаться)."""
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default().dec(amount)
+
+    def set(self, value: float):
+        self._default().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Последняя ячейка - больше верхней границы (+Inf)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        # Граница le включительна: значение попадает в первую ячейку с le >= value
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    """Распределение значений по фиксированным границам (накопительные ячейки при выводе)."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = FAST_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                label_text = self._label_text(values, [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = self._label_text(values)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{label_text} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Реестр метрик процесса и их вывод в текстовом формате Prometheus (exposition format 0.0.4)."""
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = FAST_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def expose(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.expose())
+            except Exception as e:
+                # Ошибка одной метрики (например, в функции значения) не должна ломать весь вывод
+                logging.error(f"Metrics: failed to collect {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+# Реестр процесса и метрики горячего пути. Метрики с функциями значений
+# (сессии, соединения, размеры стаканов) подключаются в main.py.
+REGISTRY = MetricsRegistry()
+
+WS_MESSAGES = REGISTRY.counter("mexc_ws_messages_total", "Depth updates received from MEXC WebSocket", ("symbol",))
+WS_DECODE_SECONDS = REGISTRY.histogram("mexc_ws_decode_seconds", "Protobuf decode time per WebSocket message")
+WS_CONNECTIONS = REGISTRY.gauge("mexc_ws_connections_open", "Connected WebSocket connections in the pool")
+WS_DISCONNECTS = REGISTRY.counter("mexc_ws_disconnects_total", "WebSocket connections dropped or failed to connect")
+
+BOOK_UPDATE_SECONDS = REGISTRY.histogram("orderbook_update_seconds", "Time to apply one depth update to the order book")
+BOOK_SNAPSHOTS = REGISTRY.counter("orderbook_snapshot_fetches_total", "REST order book snapshot fetches", ("result",))
+BOOK_RESYNCS = REGISTRY.counter("orderbook_resyncs_total", "Order book resyncs", ("reason",))
+BOOK_SYMBOLS = REGISTRY.gauge("orderbook_symbols_open", "Order books kept open by the hub")
+BOOK_LEVELS = REGISTRY.gauge("orderbook_levels", "Price levels kept in memory", ("symbol",))
+
+# Трассировка задержки: биржа -> получение (по часам биржи и бота, включает их расхождение),
+# затем возраст данных с момента получения при постановке правки и при ее доставке в Telegram
+EXCHANGE_LATENCY = REGISTRY.histogram(
+    "mexc_exchange_latency_seconds", "Local receive time minus exchange sendTime of depth updates",
+    ("symbol",), buckets=AGE_BUCKETS
+)
+DATA_AGE = REGISTRY.histogram(
+    "orderbook_data_age_seconds", "Age of displayed order book data since it was received",
+    ("symbol", "stage"), buckets=AGE_BUCKETS
+)
+
+RENDER_SECONDS = REGISTRY.histogram("orderbook_render_seconds", "Order book message render time", ("cache",))
+
+TELEGRAM_EDIT_SECONDS = REGISTRY.histogram(
+    "telegram_edit_seconds", "Telegram editMessageText request latency", buckets=NETWORK_BUCKETS
+)
+TELEGRAM_EDITS = REGISTRY.counter("telegram_edits_total", "Completed Telegram edits", ("result",))
+TELEGRAM_EDIT_ERRORS = REGISTRY.counter("telegram_edit_errors_total", "Failed Telegram edits", ("error",))
+TELEGRAM_EDITS_PENDING = REGISTRY.gauge("telegram_edits_pending", "Edits waiting in the scheduler queue")
+
+LOOP_LAG_SECONDS = REGISTRY.histogram(
+    "event_loop_lag_seconds", "How late the event loop wakes up a periodic sleep", buckets=LAG_BUCKETS
+)
+LOOP_SLOW_CALLBACKS = REGISTRY.counter(
+    "event_loop_slow_callbacks_total", "Event loop callbacks over the slow threshold by task", ("task",)
+)
+LOOP_SLOW_CALLBACK_SECONDS = REGISTRY.histogram(
+    "event_loop_slow_callback_seconds", "Duration of event loop callbacks over the slow threshold", buckets=LAG_BUCKETS
+)
+
+ACTIVE_SESSIONS = REGISTRY.gauge("bot_active_sessions", "Running order book parsing sessions")
+HTTP_REQUESTS = REGISTRY.counter("http_client_events_total", "Shared HTTP client requests and connections", ("event",))
+
+
+class MetricsServer:
+    """Локальный HTTP-сервер метрик: GET /metrics отдает REGISTRY в текстовом формате Prometheus."""
+    def __init__(self, registry: MetricsRegistry = REGISTRY, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.registry.expose().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, self.host, self.port).start()
+        except OSError as e:
+            # Занятый порт не должен мешать работе бота
+            logging.error(f"Metrics: failed to listen on {self.host}:{self.port}: {e}")
+            await self.stop()
+            return
+        logging.info(f"Metrics: serving on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,410 @@
+# services/orderbook.py
+from bisect import bisect_left, insort # Бинарный поиск по отсортированному массиву цен
+from decimal import Decimal # Разбор цен в экспоненциальной записи
+from itertools import accumulate # Накопленные суммы по уровням
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Уровень стакана: (цена, объем)
+Level = Tuple[float, float]
+# Уровень во входных данных (снимок REST, дельта): цена строкой (или числом) и объем
+RawLevel = Tuple[Any, Any]
+
+
+class PriceScaleError(ValueError):
+    """У цены больше знаков после запятой, чем точность стакана."""
+
+
+def parse_price(text: str, decimals: int) -> int:
+    """
+    Переводит десятичную строку цены в целое число шагов 10^-decimals без
+    потери точности ("0.00001234", 8 -> 1234). Лишние нули в конце допускаются;
+    значащие знаки сверх decimals - PriceScaleError.
+    """
+    whole, _, frac = text.partition(".")
+    extra = len(frac) - decimals
+    if extra > 0:
+        if frac[decimals:].strip("0"):
+            raise PriceScaleError(text)
+        frac = frac[:decimals]
+        extra = 0
+    return int(whole + frac + "0" * -extra)
+
+
+def fraction_digits(text: str) -> int:
+    """Количество значащих знаков после запятой в десятичной строке."""
+    return len(text.partition(".")[2].rstrip("0"))
+
+
+def depth_stats(asks: List[Level], bids: List[Level]) -> Dict[str, Any]:
+    """
+    Агрегаты топ-N уровней: накопленные объемы и суммы в котируемой валюте по
+    каждой стороне (i-й элемент - сумма по уровням 0..i), итоговые объемы,
+    лучшие цены, mid, спред и дисбаланс объемов.
+    asks - по возрастанию цены, bids - по убыванию (как в OrderBook.snapshot()).
+    """
+    ask_cum_volume = list(accumulate(qty for _, qty in asks))
+    bid_cum_volume = list(accumulate(qty for _, qty in bids))
+    ask_cum_notional = list(accumulate(price * qty for price, qty in asks))
+    bid_cum_notional = list(accumulate(price * qty for price, qty in bids))
+    ask_volume = ask_cum_volume[-1] if asks else 0.0
+    bid_volume = bid_cum_volume[-1] if bids else 0.0
+    total = ask_volume + bid_volume
+
+    best_ask = asks[0][0] if asks else None
+    best_bid = bids[0][0] if bids else None
+    mid = spread = spread_pct = None
+    if best_ask is not None and best_bid is not None:
+        mid = (best_ask + best_bid) / 2
+        spread = best_ask - best_bid
+        spread_pct = spread / best_ask * 100 if best_ask else None
+
+    return {
+        "ask_cum_volume": ask_cum_volume,
+        "bid_cum_volume": bid_cum_volume,
+        "ask_cum_notional": ask_cum_notional,
+        "bid_cum_notional": bid_cum_notional,
+        "ask_volume": ask_volume,
+        "bid_volume": bid_volume,
+        "ask_notional": ask_cum_notional[-1] if asks else 0.0,
+        "bid_notional": bid_cum_notional[-1] if bids else 0.0,
+        "best_ask": best_ask,
+        "best_bid": best_bid,
+        "mid": mid,
+        "spread": spread,
+        "spread_pct": spread_pct,
+        # Доля покупок в объеме (0..1) и дисбаланс (-1 - только продажи, 1 - только покупки)
+        "buy_ratio": bid_volume / total if total > 0 else 0.0,
+        "imbalance": (bid_volume - ask_volume) / total if total > 0 else 0.0,
+    }
+
+
+class BookSide:
+    """
+    Одна сторона стакана (asks или bids).
+    Цены хранятся целыми числами шагов цены (цена * scale), поэтому удаление
+    уровня по цене из дельты всегда находит точно тот же ключ. Ключи лежат в
+    отсортированном массиве (поддерживается через bisect), объемы - в словаре
+    {цена: объем}. Обновление уровня - O(log n) поиск, чтение топ-k уровней -
+    O(k) без сортировки всего стакана.
+
+    pruned_from - ключ, начиная с которого уровни стороны неизвестны: они
+    отброшены политикой хранения или не вошли в обрезанный снимок. Биржа
+    присылает только изменившиеся уровни, поэтому сами они не вернутся.
+    """
+    __slots__ = ("descending", "scale", "pruned_from", "_keys", "_qty")
+
+    def __init__(self, descending: bool = False, scale: int = 1):
+        self.descending = descending # bids: лучшая цена - максимальная
+        self.scale = scale # Сколько целых шагов в единице цены (10^decimals)
+        self.pruned_from: Optional[int] = None # Ключ первого неизвестного уровня (None - сторона полная)
+        # Ключи сортировки по возрастанию: цена для asks, -цена для bids.
+        # Так лучший уровень всегда находится в начале массива.
+        self._keys: List[int] = []
+        self._qty: Dict[int, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._qty)
+
+    def _key(self, price: int) -> int:
+        return -price if self.descending else price
+
+    def clear(self):
+        self._keys.clear()
+        self._qty.clear()
+        self.pruned_from = None
+
+    def rescale(self, factor: int):
+        """Умножает все цены на factor (переход на более мелкий шаг цены). Порядок не меняется."""
+        self.scale *= factor
+        self._keys = [key * factor for key in self._keys]
+        self._qty = {price * factor: qty for price, qty in self._qty.items()}
+        if self.pruned_from is not None:
+            self.pruned_from *= factor
+
+    def load(self, levels: Iterable[Tuple[int, float]], truncated: bool = False):
+        """
+        Полностью заменяет сторону уровнями из снимка. truncated - снимок обрезан
+        по глубине запроса: уровни дальше последнего неизвестны.
+        """
+        self._qty = {price: qty for price, qty in levels if qty != 0}
+        self._keys = sorted(self._key(price) for price in self._qty)
+        self.pruned_from = self._keys[-1] + 1 if truncated and self._keys else None
+
+    def known_levels(self) -> int:
+        """Сколько уровней от лучшей цены стороны известны полностью (до pruned_from). O(log n)."""
+        if self.pruned_from is None:
+            return len(self._keys)
+        return bisect_left(self._keys, self.pruned_from)
+
+    def update(self, price: int, qty: float):
+        """Применяет одно изменение уровня: объем 0 удаляет уровень."""
+        if qty == 0:
+            # Удаляем цену, если объем 0
+            if self._qty.pop(price, None) is not None:
+                keys = self._keys
+                del keys[bisect_left(keys, self._key(price))]
+        elif price in self._qty:
+            # Существующий уровень: порядок цен не меняется
+            self._qty[price] = qty
+        else:
+            # Новый уровень: вставка с сохранением сортировки
+            self._qty[price] = qty
+            insort(self._keys, self._key(price))
+
+    def trim(self, max_levels: Optional[int] = None, bound: Optional[float] = None, keep: int = 0) -> int:
+        """
+        Отбрасывает худшие уровни: сверх max_levels и с ключом дальше bound
+        (ключ в масштабе стороны: цена для asks, -цена для bids). Лучшие keep
+        уровней по bound не отбрасываются. Удаление идет с конца массива,
+        поэтому стоит O(1) на уровень. Возвращает число удаленных.
+        """
+        keys, qty = self._keys, self._qty
+        removed = 0
+        last = None
+        if max_levels is not None:
+            while len(keys) > max_levels:
+                last = keys.pop()
+                del qty[self._key(last)]
+                removed += 1
+        if bound is not None:
+            while len(keys) > keep and keys[-1] > bound:
+                last = keys.pop()
+                del qty[self._key(last)]
+                removed += 1
+        # Удаление идет от худших уровней к лучшим: last - ближайший к лучшей цене отброшенный
+        if last is not None and (self.pruned_from is None or last < self.pruned_from):
+            self.pruned_from = last
+        return removed
+
+    def best(self) -> Optional[Level]:
+        """Лучший уровень стороны или None, если сторона пуста."""
+        if not self._keys:
+            return None
+        price = self._key(self._keys[0])
+        return price / self.scale, self._qty[price]
+
+    def top(self, k: int) -> List[Level]:
+        """Возвращает k лучших уровней, от лучшей цены к худшей (цены - float)."""
+        qty, scale = self._qty, self.scale
+        # Деление целых в Python округляется корректно: float совпадает с float(строки цены)
+        if self.descending:
+            return [(-key / scale, qty[-key]) for key in self._keys[:k]]
+        return [(key / scale, qty[key]) for key in self._keys[:k]]
+
+
+class OrderBook:
+    """
+    Локальный стакан символа: две стороны BookSide и версия биржи
+    (lastUpdateId снимка / toVersion последней примененной дельты).
+    Используется MexcSocketService (применение снимков и дельт) и
+    utils.format_orderbook (чтение топ-N уровней).
+
+    Цены хранятся целыми числами в шагах 10^-decimals (decimals - точность цены
+    символа из exchangeInfo). Если точность неизвестна или пришла цена с большим
+    числом знаков, стакан переходит на более мелкий шаг (rescale), не теряя уровней.
+
+    Политика хранения (max_levels, max_distance_pct) ограничивает память стакана:
+    после каждого снимка и дельты худшие уровни сверх лимита или дальше заданного
+    процента от лучшей цены своей стороны отбрасываются (pruned - счетчик
+    отброшенных уровней). Лучшие min_levels уровней каждой стороны остаются
+    всегда, поэтому стакан с широким спредом (неликвидные пары) не пустеет.
+    Отброшенные уровни биржа повторно не пришлет: когда известных уровней
+    стороны до границы отброса становится меньше min_levels (лучшая цена
+    вернулась к границе или уровни "съедены"), retention_lost() сообщает, что
+    стакан нужно пересобрать из нового снимка.
+
+    Дельты только помечают стакан измененным (revision += 1). Представление
+    топ-N строится лениво в view() при чтении и кэшируется по (depth, revision),
+    так что зрители с одинаковой глубиной делят один снимок, а дельты между
+    чтениями ничего не материализуют.
+    """
+    __slots__ = (
+        "asks", "bids", "decimals", "version", "revision", "max_levels", "max_distance_pct", "min_levels", "pruned",
+        "exchange_time", "received_at", "_views", "_views_revision"
+    )
+
+    def __init__(self, decimals: int = 0, max_levels: Optional[int] = None,
+                 max_distance_pct: Optional[float] = None, min_levels: int = 0):
+        self.decimals = decimals # Знаков после запятой в цене (шаг цены 10^-decimals)
+        self.max_levels = max_levels # Максимум уровней на сторону (None - без ограничения)
+        self.max_distance_pct = max_distance_pct # Максимальное удаление уровня от лучшей цены стороны в % (None - без ограничения)
+        self.min_levels = min_levels # Сколько лучших уровней стороны не отбрасывать по удалению от цены
+        self.pruned = 0 # Сколько уровней отброшено политикой хранения
+        self.asks = BookSide(descending=False, scale=10 ** decimals) # Продажи: по возрастанию цены
+        self.bids = BookSide(descending=True, scale=10 ** decimals) # Покупки: по убыванию цены
+        self.version = 0 # Версия биржи, до которой стакан актуален (0 - неизвестна)
+        self.revision = 0 # Локальный счетчик изменений стакана
+        self.exchange_time = 0 # Время отправки последней дельты биржей (sendTime, мс; 0 - неизвестно)
+        self.received_at = 0.0 # Когда получены данные текущей версии (time.time(); 0 - неизвестно)
+        self._views: Dict[int, Dict] = {} # {depth: представление} для текущей ревизии
+        self._views_revision = -1 # Ревизия, для которой построены _views
+
+    @property
+    def size(self) -> int:
+        """Количество уровней в стакане (обе стороны)."""
+        return len(self.asks) + len(self.bids)
+
+    @property
+    def mid(self) -> Optional[float]:
+        """Середина между лучшими ценами (None, если одна из сторон пуста). O(1)."""
+        best_ask, best_bid = self.asks.best(), self.bids.best()
+        if best_ask is None or best_bid is None:
+            return None
+        return (best_ask[0] + best_bid[0]) / 2
+
+    @property
+    def spread(self) -> Optional[float]:
+        """Разница лучших цен (None, если одна из сторон пуста). O(1)."""
+        best_ask, best_bid = self.asks.best(), self.bids.best()
+        if best_ask is None or best_bid is None:
+            return None
+        return best_ask[0] - best_bid[0]
+
+    def _trim(self):
+        """Применяет политику хранения к обеим сторонам."""
+        if self.max_levels is None and self.max_distance_pct is None:
+            return
+        ask_bound = bid_bound = None
+        if self.max_distance_pct is not None:
+            # Удаление считается от лучшей цены своей стороны, а не от mid: при широком
+            # спреде граница от mid отрезала бы и лучшие уровни. Ключи bids отрицательные
+            # (-цена), поэтому граница bids - тоже со знаком минус
+            if self.asks._keys:
+                ask_bound = self.asks._keys[0] * (1 + self.max_distance_pct / 100)
+            if self.bids._keys:
+                bid_bound = self.bids._keys[0] * (1 - self.max_distance_pct / 100)
+        self.pruned += (
+            self.asks.trim(self.max_levels, ask_bound, self.min_levels)
+            + self.bids.trim(self.max_levels, bid_bound, self.min_levels)
+        )
+
+    def retention_lost(self) -> bool:
+        """
+        True, если у какой-либо стороны меньше max(min_levels, 1) известных уровней
+        перед отброшенными - верхние уровни могут быть неполными. O(log n).
+        """
+        need = max(self.min_levels, 1)
+        for side in (self.asks, self.bids):
+            if side.pruned_from is not None and side.known_levels() < need:
+                return True
+        return False
+
+    def set_decimals(self, decimals: int):
+        """Переводит стакан на точность decimals знаков (только в сторону более мелкого шага)."""
+        if decimals > self.decimals:
+            factor = 10 ** (decimals - self.decimals)
+            self.asks.rescale(factor)
+            self.bids.rescale(factor)
+            self.decimals = decimals
+
+    def price_key(self, price) -> int:
+        """Цена (строка или число) -> целый ключ стакана. При нехватке точности стакан пересчитывается."""
+        try:
+            return parse_price(price, self.decimals)
+        except PriceScaleError:
+            pass
+        except (AttributeError, ValueError):
+            # Число или экспоненциальная запись ("1e-8") - приводим к обычной десятичной строке
+            price = format(Decimal(str(price)), "f")
+            try:
+                return parse_price(price, self.decimals)
+            except PriceScaleError:
+                pass
+        self.set_decimals(fraction_digits(price))
+        return parse_price(price, self.decimals)
+
+    def load_snapshot(self, asks: Iterable[RawLevel], bids: Iterable[RawLevel], version: int = 0,
+                      received_at: float = 0.0, limit: Optional[int] = None):
+        """
+        Заменяет стакан полным снимком (цены строками, как в REST /depth).
+        Время биржи у REST-снимка неизвестно, received_at - время получения снимка.
+        limit - глубина запроса снимка: сторона из limit уровней могла быть обрезана биржей.
+        """
+        asks, bids = list(asks), list(bids)
+        self.asks.clear()
+        self.bids.clear()
+        key = self.price_key
+        decimals = self.decimals
+        ask_levels = [(key(price), float(qty)) for price, qty in asks]
+        bid_levels = [(key(price), float(qty)) for price, qty in bids]
+        if self.decimals != decimals:
+            # Точность выросла посреди разбора - пересчитываем, чтобы все ключи были в одном масштабе
+            ask_levels = [(key(price), float(qty)) for price, qty in asks]
+            bid_levels = [(key(price), float(qty)) for price, qty in bids]
+        self.asks.load(ask_levels, limit is not None and len(ask_levels) >= limit)
+        self.bids.load(bid_levels, limit is not None and len(bid_levels) >= limit)
+        self._trim()
+        self.version = version
+        self.exchange_time = 0
+        self.received_at = received_at
+        self.revision += 1
+
+    def _apply_side(self, side: BookSide, levels: Iterable[RawLevel]):
+        key, update = self.price_key, side.update
+        for price, qty in levels:
+            update(key(price), float(qty))
+
+    def apply(self, asks: Iterable[RawLevel], bids: Iterable[RawLevel], version: Optional[int] = None):
+        """Применяет инкрементальные изменения уровней (объем 0 = удаление)."""
+        self._apply_side(self.asks, asks)
+        self._apply_side(self.bids, bids)
+        self._trim()
+        if version is not None:
+            self.version = version
+        self.revision += 1
+
+    def _apply_items(self, side: BookSide, items):
+        # Горячий путь: строки Protobuf разбираются прямо в целые ключи, без промежуточных кортежей
+        key, update = self.price_key, side.update
+        for item in items:
+            update(key(item.price), float(item.quantity))
+
+    def apply_depth(self, asks, bids, version: Optional[int] = None, exchange_time: int = 0,
+                    received_at: float = 0.0):
+        """
+        Применяет дельту из repeated-полей Protobuf (см. services.pool.DepthUpdate).
+        exchange_time (мс) и received_at (сек) - отметки времени дельты для трассировки задержки.
+        """
+        self._apply_items(self.asks, asks)
+        self._apply_items(self.bids, bids)
+        self._trim()
+        if version is not None:
+            self.version = version
+        self.exchange_time = exchange_time
+        self.received_at = received_at
+        self.revision += 1
+
+    def snapshot(self, depth: int) -> Dict[str, List[Level]]:
+        """
+        Топ-depth уровней обеих сторон в формате, который ждет utils.format_orderbook:
+        {'asks': [(price, qty), ...] по возрастанию, 'bids': [...] по убыванию}.
+        """
+        return {
+            "asks": self.asks.top(depth),
+            "bids": self.bids.top(depth),
+        }
+
+    def view(self, depth: int) -> Dict:
+        """
+        Кэшированный снимок топ-depth уровней для текущей ревизии стакана.
+        Кроме уровней содержит "stats" - агрегаты depth_stats() (объемы, суммы,
+        mid, спред, дисбаланс), посчитанные один раз на ревизию, так что отрисовка
+        у каждого зрителя читает готовые значения, "decimals" - точность цены,
+        "version" - версия биржи, "exchange_time" и "received_at" - время отправки
+        данных биржей (мс) и время их получения ботом (сек).
+        Возвращаемый словарь общий для всех читателей - изменять его нельзя.
+        """
+        if self._views_revision != self.revision:
+            self._views.clear()
+            self._views_revision = self.revision
+        view = self._views.get(depth)
+        if view is None:
+            view = self.snapshot(depth)
+            view["stats"] = depth_stats(view["asks"], view["bids"])
+            view["decimals"] = self.decimals # Точность цены для форматирования
+            view["version"] = self.version # Версия биржи, которой соответствует представление
+            view["exchange_time"] = self.exchange_time
+            view["received_at"] = self.received_at
+            view["revision"] = self.revision
+            self._views[depth] = view
+        return view
@@ -0,0 +1,449 @@
+# services/pool.py
+import json
+import websockets # Библиотека для работы с WebSocket
+import asyncio
+import logging
+import ssl # Для защищенного SSL/TLS соединения
+import certifi # Для получения актуальных корневых сертификатов
+import time
+from typing import Dict, Any, List, Optional, Set
+
+# Предполагается, что этот файл PushDataV3ApiWrapper_pb2 сгенерирован из .proto-файла MEXC
+import PushDataV3ApiWrapper_pb2
+
+from services.backoff import ExponentialBackoff, CircuitBreaker # Политика переподключений
+from services.metrics import WS_MESSAGES, WS_DECODE_SECONDS, WS_DISCONNECTS # Метрики горячего пути
+from config import (
+    MEXC_WS_URL, WS_MAX_TOPICS_PER_CONNECTION, WS_HEALTHY_CONNECTION_SECONDS,
+    WS_RECV_TIMEOUT, WS_RATE_EWMA_ALPHA
+)
+
+# Поле Protobuf-объекта, содержащее данные стакана
+DEPTH_FIELD_NAME = "publicAggreDepths"
+
+# Шаблон канала агрегированного стакана. Символ - последний сегмент канала.
+DEPTH_TOPIC_TEMPLATE = "spot@public.aggre.depth.v3.api.pb@100ms@{symbol}"
+
+
+def depth_topic(symbol: str) -> str:
+    """Возвращает имя канала инкрементального стакана для символа."""
+    return DEPTH_TOPIC_TEMPLATE.format(symbol=symbol)
+
+
+def symbol_from_channel(channel: str) -> str:
+    """Извлекает символ из имени канала (spot@...@100ms@BTCUSDT -> BTCUSDT)."""
+    return channel.rsplit("@", 1)[-1] if channel else ""
+
+
+class DepthUpdate:
+    """
+    Инкрементальное обновление стакана одного символа.
+    asks/bids - repeated-поля Protobuf (элементы с полями price/quantity в виде
+    строк) без копирования в промежуточные словари: стакан разбирает числа сам,
+    сразу в свое представление (OrderBook.apply_depth).
+    """
+    __slots__ = ("symbol", "channel", "asks", "bids", "from_version", "to_version", "send_time", "received_at")
+
+    def __init__(self, symbol: str, channel: str, asks, bids, from_version: int = 0, to_version: int = 0,
+                 send_time: int = 0, received_at: float = 0.0):
+        self.symbol = symbol
+        self.channel = channel
+        self.asks = asks
+        self.bids = bids
+        self.from_version = from_version # Первая версия, которую покрывает дельта (0 - неизвестна)
+        self.to_version = to_version # Версия стакана после применения дельты (0 - неизвестна)
+        self.send_time = send_time # Время отправки биржей (sendTime или createTime обертки, мс; 0 - неизвестно)
+        self.received_at = received_at # Время получения сообщения ботом (time.time(); 0 - неизвестно)
+
+
+class ConnectionHealth:
+    """
+    Метрики здоровья одного соединения: число сообщений, сглаженная (EWMA)
+    скорость сообщений, возраст последнего сообщения, число переподключений.
+    """
+    __slots__ = ("messages", "rate", "last_message_at", "connected_at", "reconnects", "failures", "_rate_at", "_rate_count")
+
+    def __init__(self):
+        self.messages = 0 # Всего сообщений
+        self.rate = 0.0 # Сообщений в секунду (EWMA по секундным окнам)
+        self.last_message_at = 0.0 # Время последнего сообщения (time.monotonic)
+        self.connected_at = 0.0 # Время текущего подключения (0 - не подключено)
+        self.reconnects = 0 # Сколько раз соединение переподключалось
+        self.failures = 0 # Сколько раз соединение обрывалось или не подключилось
+        self._rate_at = 0.0 # Начало текущего окна подсчета скорости
+        self._rate_count = 0 # Сообщений в текущем окне
+
+    def on_connect(self, now: float):
+        self.connected_at = now
+        self.last_message_at = now
+        self._rate_at = now
+        self._rate_count = 0
+
+    def on_disconnect(self):
+        self.connected_at = 0.0
+        self.rate = 0.0
+
+    def on_message(self, now: float):
+        self.messages += 1
+        self.last_message_at = now
+        self._rate_count += 1
+        elapsed = now - self._rate_at
+        if elapsed >= 1.0:
+            sample = self._rate_count / elapsed
+            self.rate = sample if self.rate == 0 else self.rate + WS_RATE_EWMA_ALPHA * (sample - self.rate)
+            self._rate_at = now
+            self._rate_count = 0
+
+    def uptime(self, now: float) -> float:
+        return now - self.connected_at if self.connected_at else 0.0
+
+    def last_message_age(self, now: float) -> Optional[float]:
+        return now - self.last_message_at if self.last_message_at else None
+
+
+class PooledConnection:
+    """
+    Одно WebSocket-соединение пула. Держит набор подписанных каналов и
+    переподписывается на все из них после каждого переподключения.
+    """
+    def __init__(self, pool: "MexcConnectionPool", conn_id: int):
+        self.pool = pool
+        self.conn_id = conn_id
+        self.topics: Set[str] = set() # Каналы, закрепленные за соединением
+        self.ws = None # Объект WebSocket-соединения (None, пока не подключены)
+        self.running = False # Флаг для управления циклом
+        self.task: Optional[asyncio.Task] = None
+        self.connect_count = 0 # Сколько раз соединение успешно подключалось
+        self.health = ConnectionHealth()
+        self.backoff = ExponentialBackoff() # Задержка между попытками переподключения
+        self.breaker = CircuitBreaker() # Пауза в попытках после серии неудач
+
+    @property
+    def connected(self) -> bool:
+        return self.ws is not None
+
+    @property
+    def free_slots(self) -> int:
+        return self.pool.max_topics - len(self.topics)
+
+    def start(self):
+        self.running = True
+        self.task = asyncio.create_task(self._run(), name=f"ws#{self.conn_id}")
+
+    async def stop(self):
+        """Останавливает цикл и закрывает соединение."""
+        self.running = False
+        if self.ws:
+            await self.ws.close()
+        if self.task and self.task is not asyncio.current_task():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def send_method(self, method: str, topics: List[str]):
+        """Отправляет SUBSCRIPTION/UNSUBSCRIPTION, если соединение открыто."""
+        if not self.ws or not topics:
+            return
+        try:
+            await self.ws.send(json.dumps({"method": method, "params": topics}))
+        except Exception as e:
+            # Соединение уже рвется: топики будут переподписаны после реконнекта
+            logging.warning(f"WS#{self.conn_id}: failed to send {method}: {e}")
+
+    def health_snapshot(self, now: float) -> Dict[str, Any]:
+        """Метрики здоровья соединения для диагностики."""
+        age = self.health.last_message_age(now)
+        return {
+            "id": self.conn_id,
+            "connected": self.connected,
+            "topics": len(self.topics),
+            "messages": self.health.messages,
+            "message_rate": round(self.health.rate, 2),
+            "last_message_age": round(age, 1) if age is not None else None,
+            "uptime": round(self.health.uptime(now), 1),
+            "reconnects": self.health.reconnects,
+            "failures": self.health.failures,
+            "backoff_attempt": self.backoff.attempt,
+            "circuit_open_for": round(self.breaker.remaining(), 1),
+        }
+
+    async def _run(self):
+        """Цикл подключения и обработки сообщений WebSocket."""
+        while self.running:
+            # После серии неудач попытки приостановлены, каналы тем временем живут на других соединениях
+            pause = self.breaker.remaining()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                if not self.running:
+                    break
+            try:
+                # Установка соединения с автоматическими пингами/понгами
+                async with websockets.connect(
+                    self.pool.uri,
+                    ssl=self.pool.ssl_context if self.pool.uri.startswith("wss") else None,
+                    open_timeout=10,
+                    ping_interval=25,
+                    ping_timeout=10
+                ) as websocket:
+                    self.ws = websocket
+                    self.connect_count += 1
+                    self.health.on_connect(time.monotonic())
+                    if self.connect_count > 1:
+                        self.health.reconnects += 1
+                    logging.info(f"WS#{self.conn_id}: connected, subscribing to {len(self.topics)} topics")
+                    await self.send_method("SUBSCRIPTION", sorted(self.topics))
+                    if self.connect_count > 1:
+                        # После реконнекта дельты за время простоя потеряны - стаканы нужно пересобрать
+                        self.pool._notify_resubscribed(self.topics)
+
+                    while self.running:
+                        # Ожидаем входящее сообщение с таймаутом
+                        raw_message = await asyncio.wait_for(websocket.recv(), timeout=WS_RECV_TIMEOUT)
+                        self.health.on_message(time.monotonic())
+                        await self.pool._dispatch(self, raw_message)
+
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                logging.warning(f"WS#{self.conn_id}: timeout. Reconnecting...")
+            except Exception as e:
+                if self.running: # Ошибка закрытия при остановке не интересна
+                    logging.error(f"WS#{self.conn_id}: connection dropped: {e}")
+            finally:
+                self.ws = None
+
+            if not self.running:
+                break
+            # Соединение, которое долго проработало с данными, здорово: начинаем backoff заново
+            healthy = self.health.uptime(time.monotonic()) >= WS_HEALTHY_CONNECTION_SECONDS
+            self.health.on_disconnect()
+            self.health.failures += 1
+            WS_DISCONNECTS.inc()
+            if healthy:
+                self.backoff.reset()
+                self.breaker.record_success()
+            elif self.breaker.record_failure():
+                logging.error(
+                    f"WS#{self.conn_id}: {self.breaker.threshold} failed connections in a row, "
+                    f"pausing reconnects for {self.breaker.cooldown}s"
+                )
+            # Переносим каналы на живые соединения, остаток переподпишем после реконнекта
+            self.pool._rebalance(self)
+            if not self.topics:
+                self.pool._discard(self)
+                break
+            delay = self.backoff.next_delay()
+            logging.info(f"WS#{self.conn_id}: retry in {delay:.1f}s with {len(self.topics)} topics...")
+            await asyncio.sleep(delay) # Пауза перед следующей попыткой (full jitter)
+
+
+class MexcConnectionPool:
+    """
+    Пул WebSocket-соединений MEXC. Упаковывает подписки на стаканы символов в
+    небольшое число соединений (не более max_topics каналов на соединение) и
+    маршрутизирует входящие PushDataV3ApiWrapper-сообщения по символу.
+    """
+    def __init__(self, uri: str = MEXC_WS_URL, max_topics: int = WS_MAX_TOPICS_PER_CONNECTION):
+        self.uri = uri
+        self.max_topics = max_topics
+        self._connections: List[PooledConnection] = []
+        self._topic_owner: Dict[str, PooledConnection] = {} # {topic: соединение}
+        self._listeners: Dict[str, Any] = {} # {symbol: объект с методом handle_update}
+        self._next_id = 1
+        self._lock = asyncio.Lock()
+        self._send_tasks: Set[asyncio.Task] = set() # Фоновые отправки подписок (цикл хранит задачи лишь по слабой ссылке)
+
+        # Настройка SSL/TLS
+        self.ssl_context = ssl.create_default_context(cafile=certifi.where())
+        self.ssl_context.check_hostname = False
+        self.ssl_context.verify_mode = ssl.CERT_NONE
+
+    @property
+    def connection_count(self) -> int:
+        return len(self._connections)
+
+    def health(self) -> List[Dict[str, Any]]:
+        """Метрики здоровья всех соединений пула."""
+        now = time.monotonic()
+        return [conn.health_snapshot(now) for conn in self._connections]
+
+    async def subscribe(self, symbol: str, listener):
+        """
+        Подписывает символ на канал стакана. listener.handle_update(DepthUpdate)
+        будет вызываться для каждого обновления стакана этого символа, а
+        listener.handle_resubscribe() (если есть) - после переподписки канала
+        на реконнекте или при переносе на другое соединение.
+        """
+        topic = depth_topic(symbol)
+        async with self._lock:
+            self._listeners[symbol] = listener
+            if topic in self._topic_owner:
+                return
+            conn = self._pick_connection()
+            conn.topics.add(topic)
+            self._topic_owner[topic] = conn
+        # Если соединение еще подключается, канал уйдет в общей подписке после connect
+        await conn.send_method("SUBSCRIPTION", [topic])
+
+    async def unsubscribe(self, symbol: str, listener=None):
+        """
+        Отписывает символ. Пустые соединения закрываются. Если передан listener,
+        отписка выполняется только когда символ все еще закреплен за ним (защита от
+        гонки с повторной подпиской нового стакана того же символа).
+        """
+        topic = depth_topic(symbol)
+        async with self._lock:
+            if listener is not None and self._listeners.get(symbol) is not listener:
+                return
+            self._listeners.pop(symbol, None)
+            conn = self._topic_owner.pop(topic, None)
+            if conn is None:
+                return
+            conn.topics.discard(topic)
+            empty = not conn.topics
+            if empty:
+                self._discard(conn)
+        if empty:
+            await conn.stop()
+        else:
+            await conn.send_method("UNSUBSCRIPTION", [topic])
+
+    async def close(self):
+        """Закрывает все соединения пула."""
+        connections = list(self._connections)
+        self._connections.clear()
+        self._topic_owner.clear()
+        self._listeners.clear()
+        for conn in connections:
+            await conn.stop()
+
+    def _pick_connection(self) -> PooledConnection:
+        """Выбирает соединение со свободным местом (подключенные в приоритете) или создает новое."""
+        # Соединения с разомкнутым предохранителем не берем: новый канал не должен ждать паузу
+        candidates = [c for c in self._connections if c.free_slots > 0 and not c.breaker.is_open]
+        if candidates:
+            # Подключенные соединения вперед, затем самые заполненные (плотная упаковка)
+            candidates.sort(key=lambda c: (not c.connected, c.free_slots))
+            return candidates[0]
+        conn = PooledConnection(self, self._next_id)
+        self._next_id += 1
+        self._connections.append(conn)
+        conn.start()
+        logging.info(f"WS pool: opened connection #{conn.conn_id} ({len(self._connections)} total)")
+        return conn
+
+    def _discard(self, conn: PooledConnection):
+        """Убирает соединение из пула (без ожидания закрытия)."""
+        if conn in self._connections:
+            self._connections.remove(conn)
+            conn.running = False
+            logging.info(f"WS pool: closed connection #{conn.conn_id} ({len(self._connections)} left)")
+
+    def _rebalance(self, dropped: PooledConnection):
+        """
+        Переносит каналы упавшего соединения на подключенные соединения со
+        свободными слотами. Не поместившиеся каналы остаются за упавшим соединением
+        и будут переподписаны после его реконнекта.
+        """
+        moved = 0
+        for conn in self._connections:
+            if conn is dropped or not conn.connected or conn.free_slots <= 0:
+                continue
+            batch = sorted(dropped.topics)[:conn.free_slots]
+            for topic in batch:
+                dropped.topics.discard(topic)
+                conn.topics.add(topic)
+                self._topic_owner[topic] = conn
+            if batch:
+                moved += len(batch)
+                task = asyncio.create_task(conn.send_method("SUBSCRIPTION", batch))
+                self._send_tasks.add(task)
+                task.add_done_callback(self._send_tasks.discard)
+                self._notify_resubscribed(batch)
+            if not dropped.topics:
+                break
+        if moved:
+            logging.info(f"WS pool: moved {moved} topics from #{dropped.conn_id}, {len(dropped.topics)} left to resubscribe")
+
+    def _notify_resubscribed(self, topics):
+        """Сообщает слушателям символов, что их каналы переподписаны и дельты могли потеряться."""
+        for topic in list(topics):
+            listener = self._listeners.get(symbol_from_channel(topic))
+            if listener is not None and hasattr(listener, "handle_resubscribe"):
+                listener.handle_resubscribe()
+
+    async def _dispatch(self, conn: PooledConnection, raw_message):
+        """Разбирает сообщение соединения и передает обновление стакана слушателю символа."""
+        if isinstance(raw_message, bytes):
+            received_at = time.time() # Отметка получения до декодирования (трассировка задержки)
+            started = time.perf_counter()
+            message = self._deserialize_protobuf(raw_message)
+            WS_DECODE_SECONDS.observe(time.perf_counter() - started)
+            if isinstance(message, DepthUpdate):
+                message.received_at = received_at
+                WS_MESSAGES.labels(message.symbol).inc()
+                # Горячий путь: обновление стакана сразу уходит слушателю символа
+                listener = self._listeners.get(message.symbol)
+                if listener is not None:
+                    try:
+                        listener.handle_update(message)
+                    except Exception as e:
+                        # Ошибка одного символа не должна рвать соединение с остальными его каналами
+                        logging.error(f"WS pool: failed to apply update for {message.symbol}: {e}")
+                        if hasattr(listener, "request_resync"):
+                            listener.request_resync("update error")
+                return
+        else: # Если вдруг пришел текст (например, JSON-ответ на подписку)
+            try:
+                message = json.loads(raw_message)
+            except ValueError:
+                return
+
+        if not message:
+            return
+
+        # Обработка PING
+        if message.get('method') == "PING":
+            await conn.ws.send(json.dumps({"method": "PONG"}))
+            return
+
+        if message.get('msg') and message.get('code') not in (None, 0):
+            logging.warning(f"WS#{conn.conn_id}: {message}")
+
+    def _deserialize_protobuf(self, raw_data: bytes):
+        """
+        Десериализует Protobuf. Возвращает DepthUpdate для стакана, словарь для
+        служебных сообщений (PING, JSON) или пустой словарь для остальных каналов.
+        Тип сообщения определяется по oneof body обертки (HasField/hasattr для
+        каждого поля не нужны).
+        """
+        try:
+            result = PushDataV3ApiWrapper_pb2.PushDataV3ApiWrapper()
+            result.ParseFromString(raw_data)
+
+            body = result.WhichOneof("body")
+            if body == DEPTH_FIELD_NAME:
+                depth_data_pb = getattr(result, DEPTH_FIELD_NAME)
+                channel = result.channel
+                return DepthUpdate(
+                    result.symbol or symbol_from_channel(channel),
+                    channel,
+                    depth_data_pb.asks,
+                    depth_data_pb.bids,
+                    int(depth_data_pb.fromVersion or 0),
+                    int(depth_data_pb.toVersion or 0),
+                    result.sendTime or result.createTime
+                )
+
+            if result.channel == "system@ping":
+                return {"method": "PING"}
+
+        except Exception:
+            try:
+                message = raw_data.decode('utf-8', errors='ignore')
+                return json.loads(message)
+            except Exception:
+                return {}
+        return {}
@@ -1,36 +1,31 @@
 # services/repository.py
-import aiohttp # Библиотека для асинхронных HTTP-запросов
+import asyncio
 import logging
-from typing import List
+import time
+from typing import Dict, List, Optional
+
+from services.http import HttpClient # Общий HTTP-клиент с пулом соединений
+from config import MEXC_REST_URL, SYMBOLS_REFRESH_INTERVAL
 
 class MexcRepository:
     """
     Репозиторий для доступа к REST API MEXC.
-    Отвечает за получение статических данных (список торговых пар).
-    Использует aiohttp.ClientSession для эффективных асинхронных запросов.
+    Отвечает за получение статических данных (список торговых пар, точность цен).
+    Работает через общий HttpClient (одна aiohttp.ClientSession с пулом соединений).
     """
-    BASE_URL = "https://api.mexc.com/api/v3"
-
-    def __init__(self):
-        self.session = None # Сессия aiohttp для переиспользования соединений
+    BASE_URL = MEXC_REST_URL
 
-    async def _init_session(self):
-        """Инициализирует сессию, если она еще не создана или закрыта."""
-        if self.session is None or self.session.closed:
-            self.session = aiohttp.ClientSession(
-                headers={
-                    "User-Agent": "Mozilla/5.0 (Custom MEXC Bot)" 
-                }
-            )
+    def __init__(self, http: Optional[HttpClient] = None):
+        self.http = http or HttpClient() # Общий HTTP-клиент (пул соединений, keep-alive)
+        self._price_decimals: Dict[str, int] = {} # {symbol: знаков после запятой в цене} из exchangeInfo
+        self._price_decimals_loaded_at: Optional[float] = None # Время загрузки exchangeInfo (time.monotonic, None - не загружен)
+        self._exchange_info_lock = asyncio.Lock() # Один запрос exchangeInfo на всех ожидающих
 
     async def _close_session(self):
-        """Закрывает активную сессию aiohttp."""
-        if self.session and not self.session.closed:
-            await self.session.close()
-            self.session = None
+        """Закрывает HTTP-клиент (и его пул соединений)."""
+        await self.http.close()
 
     async def __aenter__(self):
-        await self._init_session()
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
@@ -39,9 +34,8 @@ class MexcRepository:
     async def get_default_symbols(self) -> List[str]:
         """Получает список рекомендуемых торговых пар."""
         url = f"{self.BASE_URL}/defaultSymbols"
-        await self._init_session()
         try:
-            async with self.session.get(url) as response:
+            async with self.http.get(url) as response:
                 if response.status == 200:
                     data = await response.json()
                     symbols = data.get('data', [])
@@ -55,3 +49,43 @@ class MexcRepository:
         except Exception as e:
             logging.error(f"Network error fetching default symbols: {e}")
             return []
+
+    async def get_price_decimals(self, symbol: str) -> Optional[int]:
+        """
+        Точность цены символа (количество знаков после запятой) из exchangeInfo.
+        Информация по всем парам загружается одним запросом и кэшируется на
+        SYMBOLS_REFRESH_INTERVAL. None - точность неизвестна.
+        """
+        async with self._exchange_info_lock:
+            loaded_at = self._price_decimals_loaded_at
+            # time.monotonic() отсчитывается от произвольной точки (например, от загрузки системы),
+            # поэтому "не загружен" - отдельный признак, а не нулевое время
+            if loaded_at is None or time.monotonic() - loaded_at > SYMBOLS_REFRESH_INTERVAL:
+                await self._load_exchange_info()
+        return self._price_decimals.get(symbol)
+
+    async def _load_exchange_info(self):
+        """
+        Загружает exchangeInfo и обновляет кэш точности цен. При ошибке кэш не
+        меняется, а повтор откладывается до следующего интервала (стаканы в это
+        время определяют точность по самим ценам).
+        """
+        url = f"{self.BASE_URL}/exchangeInfo"
+        self._price_decimals_loaded_at = time.monotonic()
+        try:
+            async with self.http.get(url) as response:
+                if response.status != 200:
+                    logging.error(f"Error fetching exchange info: HTTP {response.status}")
+                    return
+                data = await response.json()
+        except Exception as e:
+            logging.error(f"Network error fetching exchange info: {e}")
+            return
+
+        decimals = {}
+        for item in data.get('symbols', []):
+            precision = item.get('quotePrecision', item.get('quoteAssetPrecision'))
+            if item.get('symbol') and isinstance(precision, int):
+                decimals[item['symbol']] = precision
+        self._price_decimals = decimals
+        logging.info(f"Exchange info loaded: price precision for {len(decimals)} pairs")
@@ -1,213 +1,265 @@
 # services/socket.py
-import json
-import websockets # Библиотека для работы с WebSocket
 import asyncio
 import logging
-import ssl # Для защищенного SSL/TLS соединения
-import certifi # Для получения актуальных корневых сертификатов
-import aiohttp
-from typing import Dict, Any, List
+import time
+from collections import deque
+from typing import Dict, Any, Optional
 
-# --- ВАЖНО: ИМПОРТ СГЕНЕРИРОВАННОГО ФАЙЛА ---
-# Предполагается, что этот файл PushDataV3ApiWrapper_pb2 сгенерирован из .proto-файла MEXC
-import PushDataV3ApiWrapper_pb2
+from services.pool import MexcConnectionPool, DepthUpdate # Общий пул WebSocket-соединений
+from services.orderbook import OrderBook # Стакан с отсортированными уровнями цен
+from services.http import HttpClient # Общий HTTP-клиент с пулом соединений
+from services.backoff import ExponentialBackoff # Задержка между повторами загрузки снимка
+from services.repository import MexcRepository # Точность цен символа (exchangeInfo)
+from services.metrics import BOOK_UPDATE_SECONDS, BOOK_SNAPSHOTS, BOOK_RESYNCS, EXCHANGE_LATENCY # Метрики стакана
+from config import MEXC_REST_URL, BOOK_MAX_LEVELS, BOOK_MAX_DISTANCE_PCT, BOOK_MIN_LEVELS, BOOK_RETENTION_OVERRIDES
+
+# Сколько дельт буферизуется, пока загружается снимок. При переполнении
+# теряются самые старые, и ресинк просто повторится из-за разрыва версий.
+MAX_PENDING_UPDATES = 500
+# Повторные попытки загрузить снимок при ресинке: экспоненциальная задержка
+# с джиттером от SNAPSHOT_RETRY_DELAY до SNAPSHOT_RETRY_MAX_DELAY (сек)
+SNAPSHOT_RETRY_DELAY = 3
+SNAPSHOT_RETRY_MAX_DELAY = 60
+# Максимальная глубина REST-снимка, которую запрашиваем у биржи
+SNAPSHOT_MAX_LIMIT = 1000
+
+
+def retention_for(symbol: str) -> Dict[str, Any]:
+    """Политика хранения уровней стакана символа: общие настройки с учетом BOOK_RETENTION_OVERRIDES."""
+    policy = {"max_levels": BOOK_MAX_LEVELS, "max_distance_pct": BOOK_MAX_DISTANCE_PCT, "min_levels": BOOK_MIN_LEVELS}
+    policy.update(BOOK_RETENTION_OVERRIDES.get(symbol, {}))
+    return policy
+
+
+# Результаты проверки версии дельты
+VERSION_OK = "ok" # Дельта продолжает стакан, применяем
+VERSION_STALE = "stale" # Дельта уже учтена в стакане, отбрасываем
+VERSION_GAP = "gap" # Пропущены дельты, стакан рассинхронизирован
 
-# Поле Protobuf-объекта, содержащее данные стакана
-DEPTH_FIELD_NAME = "publicAggreDepths" 
 
 class MexcSocketService:
     """
-    Асинхронный сервис для подключения к WebSocket MEXC и получения данных
-    стакана (Order Book) в реальном времени. Использует Protobuf.
+    Асинхронный сервис стакана (Order Book) одного символа MEXC в реальном времени.
+    Загружает REST-снимок и получает инкрементальные обновления из общего
+    пула WebSocket-соединений (MexcConnectionPool). Использует Protobuf.
+
+    Следит за версиями дельт (fromVersion/toVersion): пока снимок в пути, дельты
+    буферизуются; устаревшие дельты отбрасываются; при разрыве версий или
+    переподписке канала стакан символа автоматически пересобирается из нового снимка.
     """
-    def __init__(self, symbol: str, update_callback):
+    def __init__(self, symbol: str, update_callback, pool: MexcConnectionPool, http: HttpClient,
+                 repository: Optional[MexcRepository] = None):
         self.symbol = symbol.replace("/", "").upper() # Нормализация тикера
         self.callback = update_callback # Колбэк
-        self.running = False # Флаг для управления циклом
-        self.ws = None # Объект WebSocket-соединения
-        self.last_data = None # Последние полученные данные стакана
-        
-        # Хранилище всего стакана (Локальный кэш)
-        # Формат: { float(price): float(quantity) }
-        self.asks_book = {}
-        self.bids_book = {}
-        
+        self.pool = pool # Пул соединений, через который приходят обновления
+        self.http = http # Общий HTTP-клиент для REST-снимков
+        self.repository = repository # Источник точности цен (без него точность берется из данных)
+        self.running = False # Флаг активности подписки
+
+        # Хранилище всего стакана (Локальный кэш) с отсортированными уровнями цен.
+        # Цены - целые числа шагов цены, точность уточняется в start().
+        # Дальние уровни отбрасываются по политике хранения, чтобы память не росла
+        self.book = OrderBook(**retention_for(self.symbol))
+
         # Флаг, что мы загрузили начальный снимок
         self.snapshot_loaded = False
-        
-        self.uri = "wss://wbs-api.mexc.com/ws" # Адрес WebSocket API
-        self.rest_uri = "https://api.mexc.com/api/v3/depth" # Адрес REST API
+        self._ready = asyncio.Event() # Стакан синхронизирован (для ожидания в wait_ready)
 
-    async def _fetch_snapshot(self):
-        """Загружает полный снимок стакана через REST API."""
+        # Дельты, пришедшие во время загрузки снимка
+        self._pending = deque(maxlen=MAX_PENDING_UPDATES)
+        self._resync_task: Optional[asyncio.Task] = None
+        self.resync_count = 0 # Количество ресинков (для диагностики)
+
+        self.rest_uri = f"{MEXC_REST_URL}/depth" # Адрес REST API снимков стакана
+        self._exchange_latency = EXCHANGE_LATENCY.labels(self.symbol) # Задержка биржа -> бот по символу
+
+    @property
+    def snapshot_limit(self) -> int:
+        """Глубина запроса снимка: уровни сверх max_levels все равно будут отброшены - не запрашиваем их."""
+        return min(SNAPSHOT_MAX_LIMIT, self.book.max_levels or SNAPSHOT_MAX_LIMIT)
+
+    async def _fetch_snapshot(self) -> Optional[Dict[str, Any]]:
+        """Загружает полный снимок стакана через REST API. Возвращает JSON или None."""
         try:
-            params = {"symbol": self.symbol, "limit": 1000}
-            async with aiohttp.ClientSession() as session:
-                async with session.get(self.rest_uri, params=params) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        
-                        # Очищаем и заполняем стакан
-                        self.asks_book = {float(p): float(q) for p, q in data.get('asks', [])}
-                        self.bids_book = {float(p): float(q) for p, q in data.get('bids', [])}
-                        
-                        self.snapshot_loaded = True
-                        logging.info(f"Snapshot loaded for {self.symbol}: {len(self.asks_book)} asks, {len(self.bids_book)} bids")
-                    else:
-                        logging.error(f"Failed to fetch snapshot: {resp.status}")
+            params = {"symbol": self.symbol, "limit": self.snapshot_limit}
+            # Соединение берется из общего пула (keep-alive) вместо новой сессии на каждый снимок
+            async with self.http.get(self.rest_uri, params=params) as resp:
+                if resp.status == 200:
+                    data = await resp.json()
+                    BOOK_SNAPSHOTS.labels("ok").inc()
+                    return data
+                logging.error(f"Failed to fetch snapshot: {resp.status}")
         except Exception as e:
             logging.error(f"Snapshot error: {e}")
+        BOOK_SNAPSHOTS.labels("error").inc()
+        return None
+
+    def _check_version(self, update: DepthUpdate) -> str:
+        """Сравнивает версии дельты с версией стакана."""
+        from_version = update.from_version
+        to_version = update.to_version
+        version = self.book.version
+        if not to_version or not version:
+            return VERSION_OK # Версий нет - применяем как есть
+        if to_version <= version:
+            return VERSION_STALE
+        if from_version > version + 1:
+            return VERSION_GAP
+        return VERSION_OK
 
-    def _process_depth_update(self, update_data):
+    def _process_depth_update(self, update: DepthUpdate):
         """Применяет инкрементальные обновления к локальному стакану."""
         if not self.snapshot_loaded:
             return # Игнорируем обновления, пока нет базы
 
-        # Обработка ASKS (Продажи)
-        for item in update_data['asks']:
-            price = float(item['price'])
-            qty = float(item['quantity'])
-            
-            if qty == 0:
-                # Удаляем цену, если объем 0
-                if price in self.asks_book:
-                    del self.asks_book[price]
-            else:
-                # Обновляем или добавляем уровень
-                self.asks_book[price] = qty
-
-        # Обработка BIDS (Покупки)
-        for item in update_data['bids']:
-            price = float(item['price'])
-            qty = float(item['quantity'])
-            
-            if qty == 0:
-                if price in self.bids_book:
-                    del self.bids_book[price]
-            else:
-                self.bids_book[price] = qty
-
-        # Формируем итоговый объект для отправки в UI
-        # Нам нужно отсортировать и вернуть список словарей, как ждет utils.py
-        
-        # Asks: сортировка по возрастанию цены (дешевые внизу стакана продаж)
-        sorted_asks = sorted(self.asks_book.items(), key=lambda x: x[0])
-        
-        # Bids: сортировка по убыванию цены (дорогие вверху стакана покупок)
-        sorted_bids = sorted(self.bids_book.items(), key=lambda x: x[0], reverse=True)
-        
-        # Преобразуем в формат списка для utils.py [{'price': ..., 'quantity': ...}]
-        # Берем топ-50 для экономии памяти, остальное храним в фоне
-        final_asks = [{'price': f"{p}", 'quantity': f"{q}"} for p, q in sorted_asks[:50]]
-        final_bids = [{'price': f"{p}", 'quantity': f"{q}"} for p, q in sorted_bids[:50]]
-        
-        self.last_data = {
-            "asks": final_asks,
-            "bids": final_bids,
-            "symbol": self.symbol
-        }
-
-    def _deserialize_protobuf(self, raw_data: bytes) -> Dict[str, Any]:
-        """Десериализует Protobuf и возвращает сырые данные обновления."""
+        # Уровни Protobuf разбираются прямо в стакан; изменение уровня - O(log n)
+        self.book.apply_depth(
+            update.asks, update.bids, update.to_version or None, update.send_time, update.received_at
+        )
+        if update.send_time and update.received_at:
+            # Отрицательное значение возможно только из-за расхождения часов - считаем его нулем
+            self._exchange_latency.observe(max(0.0, update.received_at - update.send_time / 1000))
+        # Представление для UI не строим: OrderBook.view() соберет его при чтении
+
+    def handle_update(self, update: DepthUpdate):
+        """Принимает обновление стакана от пула соединений."""
+        if not self.snapshot_loaded:
+            # Снимок в пути: копим дельты, чтобы применить их поверх снимка
+            self._pending.append(update)
+            return
+
+        status = self._check_version(update)
+        if status == VERSION_STALE:
+            return
+        if status == VERSION_GAP:
+            logging.warning(
+                f"Depth gap for {self.symbol}: book at {self.book.version}, "
+                f"got {update.from_version}-{update.to_version}"
+            )
+            # Дельты до разрыва новому снимку не нужны: буфер начинаем с этой дельты
+            self._pending.clear()
+            self.request_resync("version gap")
+            self._pending.append(update)
+            return
+
+        started = time.perf_counter()
+        self._process_depth_update(update)
+        BOOK_UPDATE_SECONDS.observe(time.perf_counter() - started)
+        if self.book.retention_lost():
+            # Отброшенные уровни снова у лучшей цены, а биржа их не пришлет - нужен новый снимок
+            logging.warning(f"Retention window of {self.symbol} exhausted, resyncing")
+            self.request_resync("retention window")
+            return
+        # Вызываем колбэк только если он задан
+        if self.callback:
+            self.callback(self.book)
+
+    def handle_resubscribe(self):
+        """Вызывается пулом, когда канал символа переподписан (реконнект/перенос соединения)."""
+        self.request_resync("resubscribed")
+
+    def request_resync(self, reason: str):
+        """
+        Помечает стакан как рассинхронизированный и запускает загрузку нового снимка.
+        Повторные вызовы во время ресинка игнорируются.
+        """
+        if not self.running:
+            return
+        # Рассинхронизированный стакан не показываем: лучше "ожидание", чем неверные данные
+        self.snapshot_loaded = False
+        self._ready.clear()
+        if self._resync_task and not self._resync_task.done():
+            return
+        # Буфер не очищаем: дельты, уже учтенные в снимке, отбросит проверка версий в _resync
+        self._resync_task = asyncio.create_task(self._resync(reason), name=f"resync:{self.symbol}")
+
+    async def _resync(self, reason: str):
+        """Загружает снимок и применяет поверх него буферизованные дельты."""
+        self.resync_count += 1
+        BOOK_RESYNCS.labels(reason).inc()
+        logging.info(f"Fetching snapshot for {self.symbol} ({reason})...")
+        backoff = ExponentialBackoff(SNAPSHOT_RETRY_DELAY, SNAPSHOT_RETRY_MAX_DELAY)
+        while self.running:
+            data = await self._fetch_snapshot()
+            if data is None:
+                await asyncio.sleep(backoff.next_delay())
+                continue
+
+            # Очищаем и заполняем стакан
+            # Цены разбираются из строк снимка точно (без float), объемы - в float
+            self.book.load_snapshot(
+                data.get('asks', []),
+                data.get('bids', []),
+                int(data.get('lastUpdateId') or 0),
+                time.time(),
+                self.snapshot_limit
+            )
+
+            # Применяем дельты, накопленные за время загрузки снимка
+            self.snapshot_loaded = True
+            gap = False
+            while self._pending:
+                update = self._pending.popleft()
+                status = self._check_version(update)
+                if status == VERSION_GAP:
+                    # Дельта новее снимка: оставляем ее и остальной буфер для следующего снимка
+                    self._pending.appendleft(update)
+                    gap = True
+                    break
+                if status == VERSION_OK:
+                    self._process_depth_update(update)
+
+            if gap:
+                # Снимок старше буферизованных дельт - нужен более свежий снимок
+                self.snapshot_loaded = False
+                logging.warning(f"Snapshot for {self.symbol} does not connect to buffered deltas, refetching...")
+                await asyncio.sleep(backoff.next_delay())
+                continue
+
+            self._ready.set()
+            logging.info(
+                f"Snapshot loaded for {self.symbol}: {len(self.book.asks)} asks, "
+                f"{len(self.book.bids)} bids, version {self.book.version}"
+            )
+            return
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """Ждет синхронизации стакана не дольше timeout. Возвращает True, если стакан готов."""
         try:
-            result = PushDataV3ApiWrapper_pb2.PushDataV3ApiWrapper()
-            result.ParseFromString(raw_data)
-
-            if hasattr(result, DEPTH_FIELD_NAME):
-                depth_data_pb = getattr(result, DEPTH_FIELD_NAME)
-                
-                asks_list = [{'price': item.price, 'quantity': item.quantity} for item in depth_data_pb.asks]
-                bids_list = [{'price': item.price, 'quantity': item.quantity} for item in depth_data_pb.bids]
-                
-                return {
-                    "asks": asks_list,
-                    "bids": bids_list,
-                    "is_depth": True
-                }
-            
-            if result.channel == "system@ping":
-                return {"method": "PING"}
-
-        except Exception:
-            try:
-                message = raw_data.decode('utf-8', errors='ignore')
-                return json.loads(message)
-            except:
-                return {}
-        return {}
+            await asyncio.wait_for(self._ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
 
     async def start(self):
-        """Запускает цикл подключения и обработки сообщений WebSocket."""
+        """Подписывает символ в пуле WebSocket-соединений и загружает снимок стакана."""
         self.running = True
-        
-        # 1. Сначала загружаем снимок REST API
-        logging.info(f"Fetching snapshot for {self.symbol}...")
-        await self._fetch_snapshot()
-        
-        # Настройка SSL/TLS
-        ssl_context = ssl.create_default_context(cafile=certifi.where())
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
 
-        while self.running:
-            try:
-                # Установка соединения с автоматическими пингами/понгами
-                async with websockets.connect(
-                    self.uri, 
-                    ssl=ssl_context, 
-                    open_timeout=10,
-                    ping_interval=25, 
-                    ping_timeout=10
-                ) as websocket:
-                    self.ws = websocket
-                    logging.info(f"Connected to WS for {self.symbol}")
-                    
-                    # Подписка на Incremental Depth (изменения)
-                    topic = f"spot@public.aggre.depth.v3.api.pb@100ms@{self.symbol}"
-                    payload = {"method": "SUBSCRIPTION", "params": [topic]}
-                    await websocket.send(json.dumps(payload))
-
-                    while self.running:
-                        try:
-                            # Ожидаем входящее сообщение с таймаутом
-                            raw_message = await asyncio.wait_for(self.ws.recv(), timeout=35.0)
-                            
-                            if isinstance(raw_message, bytes):
-                                update_data = self._deserialize_protobuf(raw_message)
-                            else: # Если вдруг пришел текст (например, JSON-ответ на подписку)
-                                update_data = json.loads(raw_message)
-
-                            if not update_data: continue
-
-                            # Обработка PING
-                            if update_data.get('method') == "PING":
-                                await self.ws.send(json.dumps({"method": "PONG"}))
-                                continue
-                            
-                            # Получение данных стакана (обновление last_data)
-                            if update_data.get('is_depth'):
-                                self._process_depth_update(update_data)
-                                # Вызываем колбэк только если есть данные (last_data формируется внутри process)
-                                if self.last_data:
-                                    self.callback(self.last_data)
-
-                        except asyncio.TimeoutError:
-                            logging.warning("Timeout. Reconnecting...")
-                            break 
-                        except Exception as e:
-                            logging.error(f"WS Error: {e}")
-                            break
-            
-            except Exception as e:
-                logging.error(f"Connection dropped: {e}. Retry in 5s...")
-                await asyncio.sleep(5) # Пауза перед следующей попыткой
+        # 1. Подписка на Incremental Depth (изменения): дельты копятся, пока грузится снимок
+        await self.pool.subscribe(self.symbol, self)
+
+        # Точность цены символа: ключи стакана - целые числа шагов 10^-decimals
+        if self.repository is not None:
+            decimals = await self.repository.get_price_decimals(self.symbol)
+            if decimals is not None:
+                self.book.set_decimals(decimals)
+
+        # 2. Загружаем снимок REST API и применяем накопленные дельты
+        self.request_resync("initial snapshot")
+        await self._resync_task
 
     async def stop(self):
-        """Останавливает цикл и закрывает соединение."""
+        """Отписывает символ от пула соединений."""
         self.running = False
-        if self.ws:
-            await self.ws.close()
+        if self._resync_task and not self._resync_task.done():
+            self._resync_task.cancel()
+        await self.pool.unsubscribe(self.symbol, self)
 
-    def get_latest_data(self) -> Dict[str, Any]:
-        """Возвращает последние полученные данные стакана."""
-        return self.last_data
+    def get_latest_data(self, depth: int = 50) -> Optional[Dict[str, Any]]:
+        """
+        Возвращает топ-depth уровней стакана (или None, пока стакан не синхронизирован).
+        Представление строится по запросу и кэшируется на текущую ревизию стакана.
+        """
+        if not self.snapshot_loaded:
+            return None
+        return self.book.view(depth)
@@ -2,10 +2,13 @@
 import json # Для работы с JSON-файлами
 import os # Для проверки существования файла и создания директорий
 import asyncio # Для асинхронного выполнения
-from typing import Dict, Any, Optional
+import sqlite3 # Встроенная SQLite для построчного хранилища
+from concurrent.futures import ThreadPoolExecutor # Один поток-писатель для SQLite
+from typing import Dict, Any, Optional, Set
 from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType # Базовые классы для создания хранилища
 from aiogram.fsm.state import State
 import logging
+from config import STORAGE_FLUSH_INTERVAL_MS
 
 # Настройка логирования для отладки
 logger = logging.getLogger(__name__)
@@ -15,11 +18,22 @@ class JSONStorage(BaseStorage):
     Файловое хранилище FSM, которое сохраняет состояние в states.json.
     Использует asyncio.to_thread для асинхронной записи, чтобы не блокировать
     основной цикл бота.
+
+    В режиме write-behind (по умолчанию) изменения только помечают ключи как
+    измененные, а файл перезаписывается не чаще раза в flush_interval_ms одним
+    писателем (и при close()). Запись атомарная: временный файл + os.replace,
+    поэтому файл не обрезается при сбое или параллельной записи.
     """
-    def __init__(self, filename: str = "states.json"):
+    def __init__(self, filename: str = "states.json", write_behind: bool = True,
+                 flush_interval_ms: int = STORAGE_FLUSH_INTERVAL_MS):
         self.filename = filename
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval_ms / 1000
         # FIX: Загружаем данные синхронно, так как __init__ - синхронный метод
         self._data = self._sync_load_data() 
+        self._dirty: Set[str] = set() # Ключи, измененные после последней записи
+        self._flush_task: Optional[asyncio.Task] = None # Отложенная запись
+        self._write_lock = asyncio.Lock() # Единственный писатель файла
         logger.info(f"JSONStorage initialized. {len(self._data)} sessions loaded.")
 
     def _sync_load_data(self) -> Dict[str, Any]:
@@ -33,21 +47,51 @@ class JSONStorage(BaseStorage):
             logger.error(f"Error loading states from file (starting fresh): {e}")
             return {}
 
-    def _sync_save_data(self):
-        """Синхронное сохранение данных в файл. Выполняется в отдельном потоке."""
+    def _sync_save_data(self, payload: str) -> bool:
+        """Синхронная атомарная запись в файл. Выполняется в отдельном потоке."""
+        tmp_filename = f"{self.filename}.tmp"
         try:
             # Создаем директорию, если это необходимо
             os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True) 
-            with open(self.filename, "w", encoding="utf-8") as f:
-                # dump сохраняет данные в файл. sort_keys=True для стабильного порядка.
-                json.dump(self._data, f, ensure_ascii=False, indent=2, sort_keys=True)
+            with open(tmp_filename, "w", encoding="utf-8") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            # Подмена файла атомарна: читатель видит либо старую, либо новую версию
+            os.replace(tmp_filename, self.filename)
             logger.debug(f"State data successfully saved to {self.filename}")
-        except IOError as e:
+            return True
+        except OSError as e:
             logger.error(f"Error saving states to file: {e}")
+            return False
+
+    async def _flush(self):
+        """Записывает текущее состояние на диск, если есть изменения."""
+        async with self._write_lock:
+            if not self._dirty:
+                return
+            dirty = self._dirty
+            self._dirty = set()
+            # Сериализуем в цикле событий: снимок согласован, пока никто не меняет _data.
+            # Компактный JSON без отступов и сортировки ключей.
+            payload = json.dumps(self._data, ensure_ascii=False, separators=(",", ":"))
+            if not await asyncio.to_thread(self._sync_save_data, payload):
+                self._dirty |= dirty # Не записали - повторим при следующей записи
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_interval)
+        await self._flush()
+        if self._dirty:
+            # Изменения, пришедшие во время записи (или не записанные из-за ошибки), - следующей записью
+            self._flush_task = asyncio.create_task(self._delayed_flush())
 
-    async def _save_data(self):
-        """Асинхронное сохранение с использованием отдельного потока."""
-        await asyncio.to_thread(self._sync_save_data)
+    async def _save_data(self, k: str):
+        """Помечает ключ измененным и планирует запись (или пишет сразу без write-behind)."""
+        self._dirty.add(k)
+        if not self.write_behind:
+            await self._flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
         
     def _get_key(self, key: StorageKey) -> str:
         # Уникальный ключ для пользователя: chat_id + user_id
@@ -62,7 +106,7 @@ class JSONStorage(BaseStorage):
             self._data[k] = {}
         
         self._data[k]["state"] = state.state if isinstance(state, State) else state
-        await self._save_data() # Сохраняем на диск
+        await self._save_data(k) # Сохраняем на диск (отложенно в режиме write-behind)
 
     async def get_state(self, key: StorageKey) -> Optional[str]:
         """Получает текущее состояние FSM."""
@@ -75,7 +119,7 @@ class JSONStorage(BaseStorage):
         if k not in self._data:
             self._data[k] = {}
         self._data[k]["data"] = data.copy()
-        await self._save_data()
+        await self._save_data(k)
 
     async def get_data(self, key: StorageKey) -> Dict[str, Any]:
         """Получает данные контекста FSM."""
@@ -91,8 +135,149 @@ class JSONStorage(BaseStorage):
 
     async def close(self) -> None:
         """Вызывается при завершении работы диспетчера. Сохраняет последние данные."""
-        await self._save_data()
+        # Запись не отменяем: отмена посреди to_thread отпустила бы блокировку, пока поток
+        # еще пишет .tmp-файл. Дожидаемся текущей (и запланированной ею следующей) записи
+        while self._flush_task and not self._flush_task.done():
+            await asyncio.shield(self._flush_task)
+        await self._flush()
         
-    def get_all_active_users(self):
-        """Возвращает список всех сохраненных сессий для восстановления."""
-        return self._data
\ No newline at end of file
+    def get_all_active_users(self, state: Optional[str] = None):
+        """
+        Возвращает сохраненные сессии для восстановления: {"chat_id:user_id": {"state", "data"}}.
+        Если передан state, возвращаются только сессии в этом состоянии.
+        """
+        if state is None:
+            return self._data
+        return {k: v for k, v in self._data.items() if v.get("state") == state}
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM на локальной SQLite (режим WAL).
+    Каждое set_state/set_data - upsert одной строки, а не перезапись всех
+    пользователей, как в JSONStorage. Запросы выполняются в одном фоновом потоке,
+    поэтому не блокируют цикл событий и применяются строго в порядке вызова.
+    Индекс по столбцу state позволяет восстанавливать сессии парсинга без полного просмотра.
+    """
+    def __init__(self, filename: str = "states.db", migrate_from: Optional[str] = None):
+        self.filename = filename
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        self._conn = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL") # В WAL-режиме безопасно и быстрее FULL
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            " key TEXT PRIMARY KEY,"
+            " state TEXT,"
+            " data TEXT NOT NULL DEFAULT '{}')"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS fsm_state ON fsm(state)")
+        # Кэш прочитанных строк: чтения FSM не ходят в поток БД повторно
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._closed = False
+        if migrate_from:
+            self._migrate_json(migrate_from)
+        count = self._conn.execute("SELECT COUNT(*) FROM fsm").fetchone()[0]
+        logger.info(f"SQLiteStorage initialized. {count} sessions stored.")
+
+    def _migrate_json(self, filename: str):
+        """Однократно переносит сессии из states.json, если база еще пустая."""
+        if not os.path.exists(filename) or self._conn.execute("SELECT 1 FROM fsm LIMIT 1").fetchone():
+            return
+        try:
+            with open(filename, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logger.error(f"Error reading {filename} for migration: {e}")
+            return
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO fsm(key, state, data) VALUES (?, ?, ?)",
+                [(k, v.get("state"), json.dumps(v.get("data", {}), ensure_ascii=False)) for k, v in data.items()]
+            )
+        logger.info(f"Migrated {len(data)} sessions from {filename} to {self.filename}")
+
+    async def _run(self, fn, *args):
+        """Выполняет функцию в потоке БД."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _get_key(self, key: StorageKey) -> str:
+        # Уникальный ключ для пользователя: chat_id + user_id (как в JSONStorage)
+        return f"{key.chat_id}:{key.user_id}"
+
+    def _sync_load_row(self, k: str) -> Dict[str, Any]:
+        row = self._conn.execute("SELECT state, data FROM fsm WHERE key = ?", (k,)).fetchone()
+        if row is None:
+            return {"state": None, "data": {}}
+        return {"state": row[0], "data": json.loads(row[1])}
+
+    async def _row(self, k: str) -> Dict[str, Any]:
+        row = self._cache.get(k)
+        if row is None:
+            loaded = await self._run(self._sync_load_row, k)
+            # Параллельный промах по тому же ключу мог уже загрузить и изменить строку - она новее
+            row = self._cache.setdefault(k, loaded)
+        return row
+
+    def _sync_upsert(self, sql: str, params: tuple):
+        try:
+            self._conn.execute(sql, params)
+        except sqlite3.Error as e:
+            logger.error(f"Error saving state to SQLite: {e}")
+
+    # --- Методы FSM API ---
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        """Устанавливает новое состояние FSM для пользователя (одна строка)."""
+        k = self._get_key(key)
+        value = state.state if isinstance(state, State) else state
+        (await self._row(k))["state"] = value
+        await self._run(
+            self._sync_upsert,
+            "INSERT INTO fsm(key, state) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET state = excluded.state",
+            (k, value)
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        """Получает текущее состояние FSM."""
+        return (await self._row(self._get_key(key)))["state"]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        """Устанавливает данные контекста FSM (одна строка)."""
+        k = self._get_key(key)
+        (await self._row(k))["data"] = data.copy()
+        await self._run(
+            self._sync_upsert,
+            "INSERT INTO fsm(key, data) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+            (k, json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        """Получает данные контекста FSM."""
+        return (await self._row(self._get_key(key)))["data"].copy()
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Обновляет данные контекста FSM (мержит старые и новые)."""
+        current_data = await self.get_data(key)
+        current_data.update(data)
+        await self.set_data(key, current_data)
+        return current_data
+
+    async def close(self) -> None:
+        """Дожидается записи всех изменений и закрывает базу. Повторный вызов ничего не делает."""
+        if self._closed:
+            return
+        self._closed = True
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+
+    def get_all_active_users(self, state: Optional[str] = None):
+        """
+        Возвращает сохраненные сессии для восстановления: {"chat_id:user_id": {"state", "data"}}.
+        Если передан state, выборка идет по индексу fsm_state.
+        """
+        if state is None:
+            rows = self._conn.execute("SELECT key, state, data FROM fsm")
+        else:
+            rows = self._conn.execute("SELECT key, state, data FROM fsm WHERE state = ?", (state,))
+        return {k: {"state": st, "data": json.loads(data)} for k, st, data in rows}
\ No newline at end of file
@@ -0,0 +1,35 @@
+# tests/test_edit_scheduler.py
+import asyncio
+
+from services.edit_scheduler import EditScheduler, EDIT_SENT
+
+
+class SlowBot:
+    """Бот, который отвечает на правки с заданными задержками и запоминает порядок доставки."""
+    def __init__(self, *latencies: float):
+        self.latencies = list(latencies)
+        self.started = []
+        self.delivered = []
+
+    async def edit_message_text(self, text, chat_id, message_id, reply_markup=None):
+        self.started.append(text)
+        await asyncio.sleep(self.latencies.pop(0))
+        self.delivered.append(text)
+
+
+def test_newer_edit_waits_for_the_one_in_flight():
+    async def scenario():
+        bot = SlowBot(0.1, 0.01) # Старая правка отвечает дольше новой
+        scheduler = EditScheduler(bot, global_rate=1000, per_chat_rate=1000)
+        first = scheduler.submit(1, 1, "old")
+        await asyncio.sleep(0.01) # "old" уже отправляется
+        second = scheduler.submit(1, 1, "new")
+        results = await asyncio.gather(first, second)
+        await scheduler.stop()
+        return bot, results
+
+    bot, results = asyncio.run(scenario())
+    assert results == [EDIT_SENT, EDIT_SENT]
+    # Новый текст ушел только после ответа на старый и остался на экране последним
+    assert bot.started == ["old", "new"]
+    assert bot.delivered == ["old", "new"]
@@ -0,0 +1,60 @@
+# tests/test_orderbook.py
+from services.orderbook import OrderBook
+
+
+def test_wide_spread_keeps_best_levels():
+    # Неликвидная пара: спред ~26% - граница от mid отрезала бы обе лучшие цены
+    book = OrderBook(decimals=3, max_levels=200, max_distance_pct=10.0, min_levels=20)
+    book.load_snapshot([["0.013", "5"], ["0.014", "7"]], [["0.010", "3"], ["0.009", "4"]], 1)
+
+    assert book.size == 4
+    assert book.asks.best() == (0.013, 5.0)
+    assert book.bids.best() == (0.010, 3.0)
+    assert book.pruned == 0
+
+
+def test_wide_spread_without_min_levels_measures_from_best_price():
+    book = OrderBook(decimals=3, max_distance_pct=10.0)
+    book.load_snapshot([["0.013", "5"], ["0.020", "1"]], [["0.010", "3"], ["0.005", "1"]], 1)
+
+    # Лучшие цены остаются, дальние (>10% от лучшей цены своей стороны) отброшены
+    assert book.asks.top(5) == [(0.013, 5.0)]
+    assert book.bids.top(5) == [(0.010, 3.0)]
+    assert book.pruned == 2
+
+
+def test_min_levels_survive_distance_limit():
+    asks = [[f"{100 + i * 5}", "1"] for i in range(30)]
+    bids = [[f"{99 - i * 3}", "1"] for i in range(30)]
+    book = OrderBook(max_distance_pct=1.0, min_levels=20)
+    book.load_snapshot(asks, bids, 1)
+
+    assert len(book.asks) == 20
+    assert len(book.bids) == 20
+    assert book.asks.top(1) == [(100.0, 1.0)]
+
+
+def test_best_price_back_at_prune_boundary_loses_retention():
+    book = OrderBook(max_distance_pct=10.0, min_levels=2)
+    book.load_snapshot([[f"{100 + i}", "1"] for i in range(16)], [["90", "1"]], 1)
+    assert book.asks.pruned_from == 111 # 111-115 дальше 10% от лучшей цены
+    assert not book.retention_lost()
+
+    # Цена ушла вниз: уровни выше 99 отброшены (кроме min_levels лучших)
+    book.apply([["89.5", "1"]], [["80", "1"]])
+    assert book.asks.top(2) == [(89.5, 1.0), (100.0, 1.0)]
+    assert not book.retention_lost()
+
+    # Цена вернулась: выше 100 стакан неизвестен, пока не загружен новый снимок
+    book.apply([["89.5", "0"]], [])
+    assert book.retention_lost()
+
+
+def test_truncated_snapshot_loses_retention_when_levels_are_eaten():
+    book = OrderBook(max_levels=5, min_levels=3)
+    book.load_snapshot([[f"{100 + i}", "1"] for i in range(5)], [["99", "1"]], 1, limit=5)
+    assert not book.retention_lost()
+
+    # Съедены три лучших уровня: уровней за обрезкой снимка биржа не пришлет
+    book.apply([["100", "0"], ["101", "0"], ["102", "0"]], [])
+    assert book.retention_lost()
@@ -0,0 +1,85 @@
+# tests/test_socket.py
+import asyncio
+from types import SimpleNamespace
+
+from services.pool import DepthUpdate
+from services.orderbook import OrderBook
+from services.socket import MexcSocketService
+
+
+class FakePool:
+    async def subscribe(self, symbol, listener):
+        pass
+
+    async def unsubscribe(self, symbol, listener=None):
+        pass
+
+
+def _delta(from_version, to_version, price="101.0", quantity="1"):
+    level = SimpleNamespace(price=price, quantity=quantity)
+    return DepthUpdate("BTCUSDT", "", [level], [], from_version, to_version)
+
+
+def _service(snapshots):
+    service = MexcSocketService("BTCUSDT", None, FakePool(), None)
+    fetched = []
+
+    async def fetch():
+        fetched.append(True)
+        return snapshots[min(len(fetched), len(snapshots)) - 1]
+
+    service._fetch_snapshot = fetch
+    return service, fetched
+
+
+def test_initial_snapshot_keeps_deltas_buffered_before_resync():
+    async def scenario():
+        snapshot = {"asks": [["102.0", "2"]], "bids": [["99.0", "3"]], "lastUpdateId": 10}
+        service, fetched = _service([snapshot])
+        service.running = True
+        # Дельты пришли после подписки, пока загружалась точность цен
+        for version in (9, 10, 11, 12):
+            service.handle_update(_delta(version, version, price=f"10{version - 8}.0"))
+        service.request_resync("initial snapshot")
+        await service._resync_task
+        return service, fetched
+
+    service, fetched = asyncio.run(scenario())
+    assert len(fetched) == 1 # Снимок продолжился буфером, повторной загрузки нет
+    assert service.book.version == 12
+    assert service.snapshot_loaded
+
+
+def test_lagging_snapshot_keeps_buffer_for_refetch(monkeypatch):
+    monkeypatch.setattr("services.socket.SNAPSHOT_RETRY_DELAY", 0.01)
+
+    async def scenario():
+        old = {"asks": [["102.0", "2"]], "bids": [["99.0", "3"]], "lastUpdateId": 8}
+        fresh = {"asks": [["102.0", "2"]], "bids": [["99.0", "3"]], "lastUpdateId": 11}
+        service, fetched = _service([old, fresh])
+        service.running = True
+        for version in (10, 11, 12):
+            service.handle_update(_delta(version, version))
+        service.request_resync("initial snapshot")
+        await service._resync_task
+        return service, fetched
+
+    service, fetched = asyncio.run(scenario())
+    # Первый снимок отстал от потока; буфер сохранен и продолжает второй снимок
+    assert len(fetched) == 2
+    assert service.book.version == 12
+
+
+def test_returning_to_pruned_levels_requests_resync():
+    service, _ = _service([])
+    service.running = True
+    service.book = OrderBook(max_distance_pct=10.0, min_levels=2)
+    service.book.load_snapshot([[f"{100 + i}", "1"] for i in range(16)], [["90", "1"]], 1)
+    service.snapshot_loaded = True
+    reasons = []
+    service.request_resync = reasons.append
+
+    service.handle_update(_delta(2, 2, price="89.5"))
+    assert reasons == []
+    service.handle_update(_delta(3, 3, price="89.5", quantity="0"))
+    assert reasons == ["retention window"]
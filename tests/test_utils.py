@@ -0,0 +1,31 @@
+# tests/test_utils.py
+import utils
+from utils import format_orderbook, orderbook_fingerprint
+
+
+def _view(exchange_time):
+    return {
+        "asks": [(101.5, 2.0), (102.0, 1.0)],
+        "bids": [(100.5, 3.0), (100.0, 4.0)],
+        "exchange_time": exchange_time,
+    }
+
+
+def test_fingerprint_ignores_data_time_footer(monkeypatch):
+    monkeypatch.setattr(utils, "ORDERBOOK_SHOW_DATA_TIME", True)
+    # Та же ревизия стакана, но новое время данных - правка не нужна
+    first = format_orderbook("BTCUSDT", _view(1700000000000), 2)
+    second = format_orderbook("BTCUSDT", _view(1700000001234), 2)
+
+    assert first != second
+    assert orderbook_fingerprint(first) == orderbook_fingerprint(second)
+    assert orderbook_fingerprint(first, include_timestamp=True) != orderbook_fingerprint(second, include_timestamp=True)
+
+
+def test_fingerprint_tracks_book_changes_with_data_time(monkeypatch):
+    monkeypatch.setattr(utils, "ORDERBOOK_SHOW_DATA_TIME", True)
+    changed = _view(1700000000000)
+    changed["asks"] = [(101.5, 5.0), (102.0, 1.0)]
+
+    assert orderbook_fingerprint(format_orderbook("BTCUSDT", _view(1700000000000), 2)) != \
+        orderbook_fingerprint(format_orderbook("BTCUSDT", changed, 2))
@@ -0,0 +1,253 @@
+# tools/loadtest.py
+"""
+Нагрузочный тест бота целиком: N зрителей (сессий parsing_loop) на M символах
+против локального стенда MEXC (tools/standin.py) и поддельного Telegram Bot API.
+
+    python -m tools.loadtest --users 2000 --symbols 100 --duration 60
+    python -m tools.loadtest --users 5000 --symbols 300 --global-rate 1000 --output load.json
+
+Стенд MEXC и поддельный Telegram работают в отдельном потоке со своим циклом
+событий, поэтому CPU и задержка цикла событий измеряются только для бота.
+Отчет: пропускная способность правок, задержка данных (отправка дельты
+стендом -> получение правки "Telegram"), задержка цикла событий бота,
+память на сессию и CPU на символ.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+LOADTEST_TOKEN = "123456789:LOADTEST" # Токен нужного формата; запросы уходят в поддельный API
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p99": None, "max": None}
+    values = sorted(values)
+    pick = lambda q: round(values[min(len(values) - 1, int(q * (len(values) - 1)))], 2)
+    return {"p50": pick(0.50), "p99": pick(0.99), "max": round(values[-1], 2)}
+
+
+def _rss_bytes() -> int:
+    """Текущий RSS процесса (Linux: /proc/self/statm; иначе - пиковый RSS)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class FakeTelegram:
+    """Поддельный Bot API: принимает editMessageText и считает задержку данных."""
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency # Искусственная задержка ответа (сек)
+        self.pending: Dict[Tuple[int, int], float] = {} # {(chat_id, message_id): время отправки версии стендом}
+        self.staleness: List[Tuple[float, float]] = [] # (время получения, задержка в мс)
+        self.requests = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == "editMessageText":
+            now = time.time()
+            sent_at = self.pending.pop((int(data["chat_id"]), int(data["message_id"])), None)
+            if sent_at is not None:
+                self.staleness.append((now, (now - sent_at) * 1000))
+            return web.json_response({"ok": True, "result": True})
+        return web.json_response({"ok": True, "result": True})
+
+
+class Backend(threading.Thread):
+    """Поток со стендом MEXC и поддельным Telegram на отдельном цикле событий."""
+    def __init__(self, standin, telegram: FakeTelegram, port: int, telegram_port: int):
+        super().__init__(daemon=True)
+        self.standin = standin
+        self.telegram = telegram
+        self.port = port
+        self.telegram_port = telegram_port
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._start())
+        self.ready.set()
+        self.loop.run_forever()
+
+    async def _start(self):
+        await self.standin.start("127.0.0.1", self.port)
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.telegram.handle)
+        self._telegram_runner = web.AppRunner(app, access_log=None)
+        await self._telegram_runner.setup()
+        await web.TCPSite(self._telegram_runner, "127.0.0.1", self.telegram_port).start()
+
+    async def _stop(self):
+        await self._telegram_runner.cleanup()
+        await self.standin.stop()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._stop(), self.loop).result(timeout=10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+async def _monitor_loop_lag(samples: List[Tuple[float, float]], interval: float = 0.1):
+    """Задержка цикла событий: насколько позже запланированного просыпается sleep(interval)."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append((time.time(), max(0.0, (loop.time() - expected) * 1000)))
+
+
+async def run_load(args, standin, telegram: FakeTelegram) -> Dict:
+    import main as bot_main # Импорт после настройки окружения (адреса MEXC, токен)
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from services.edit_scheduler import EditScheduler
+
+    # Бот шлет запросы в поддельный Telegram; лимиты планировщика задаются тестом
+    await bot_main.bot.session.close()
+    bot_main.bot.session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{args.telegram_port}"))
+    bot_main.edit_scheduler = EditScheduler(
+        bot_main.bot, global_rate=args.global_rate, per_chat_rate=args.per_chat_rate
+    )
+
+    # Трассировка задержки: какая версия стакана попала в текст и когда стенд ее отправил
+    rendered: Dict[str, Tuple[str, int]] = {}
+    original_format = bot_main.format_orderbook
+
+    def traced_format(symbol, data, depth):
+        text = original_format(symbol, data, depth)
+        if len(rendered) > 100000:
+            rendered.clear()
+        rendered[text] = (symbol, data.get("version"))
+        return text
+
+    original_submit = bot_main.edit_scheduler.submit
+
+    def traced_submit(chat_id, message_id, text, reply_markup=None, trace=None):
+        info = rendered.pop(text, None)
+        if info is not None:
+            sent_at = standin.send_times.get(info[0], {}).get(info[1])
+            if sent_at is not None:
+                telegram.pending[(chat_id, message_id)] = sent_at
+        return original_submit(chat_id, message_id, text, reply_markup, trace)
+
+    bot_main.format_orderbook = traced_format
+    bot_main.edit_scheduler.submit = traced_submit
+
+    lag: List[Tuple[float, float]] = []
+    lag_task = asyncio.create_task(_monitor_loop_lag(lag))
+    rss_before = _rss_bytes()
+
+    symbols = sorted(standin.books)[:args.symbols]
+    sessions = []
+    logging.info(f"Load test: starting {args.users} sessions on {len(symbols)} symbols over {args.ramp}s")
+    for i in range(args.users):
+        sessions.append(asyncio.create_task(bot_main.parsing_loop(
+            100000 + i, i + 1, symbols[i % len(symbols)], args.interval, args.depth
+        )))
+        if args.ramp:
+            await asyncio.sleep(args.ramp / args.users)
+
+    await asyncio.sleep(args.warmup)
+    window_start = time.time()
+    cpu_start = time.thread_time()
+    edits_start = telegram.requests
+    await asyncio.sleep(args.duration)
+    cpu = time.thread_time() - cpu_start
+    edits = telegram.requests - edits_start
+    rss_after = _rss_bytes()
+
+    for task in sessions:
+        task.cancel()
+    await asyncio.gather(*sessions, return_exceptions=True)
+    lag_task.cancel()
+    await bot_main.edit_scheduler.stop()
+    # Планировщик не ждет уже отправленные правки: даем им завершиться до закрытия сессии бота
+    await asyncio.sleep(args.api_latency + 0.5)
+    await bot_main.market_hub.close()
+    await bot_main.http_client.close()
+    await bot_main.bot.session.close()
+
+    window = lambda samples: [value for at, value in samples if at >= window_start]
+    return {
+        "users": args.users,
+        "symbols": len(symbols),
+        "interval": args.interval,
+        "depth": args.depth,
+        "duration": args.duration,
+        "edits_per_s": round(edits / args.duration, 1),
+        "staleness_ms": _percentiles(window(telegram.staleness)),
+        "loop_lag_ms": _percentiles(window(lag)),
+        "memory_per_session_kib": round((rss_after - rss_before) / args.users / 1024, 1),
+        "rss_mib": round(rss_after / 2**20, 1),
+        "cpu_percent_total": round(cpu / args.duration * 100, 1),
+        "cpu_percent_per_symbol": round(cpu / args.duration * 100 / len(symbols), 3),
+        "exchange_messages_sent": standin.sent,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test against local MEXC and Telegram stand-ins")
+    parser.add_argument("--users", type=int, default=1000, help="simulated viewers (parsing sessions)")
+    parser.add_argument("--symbols", type=int, default=50, help="symbols the viewers are spread across")
+    parser.add_argument("--rate", type=float, default=10, help="exchange messages per second per symbol")
+    parser.add_argument("--recording", help="replay a tools.recorder log instead of synthetic symbols")
+    parser.add_argument("--fanout", type=int, default=1, help="clone recorded symbols N times")
+    parser.add_argument("--interval", type=int, default=1, help="session refresh interval (sec)")
+    parser.add_argument("--depth", type=int, default=10, help="session order book depth")
+    parser.add_argument("--ramp", type=float, default=5, help="seconds to start all sessions")
+    parser.add_argument("--warmup", type=float, default=10, help="seconds before measuring")
+    parser.add_argument("--duration", type=float, default=30, help="measurement window (sec)")
+    parser.add_argument("--global-rate", type=float, default=1000, help="EditScheduler global edits/s (Telegram allows ~30)")
+    parser.add_argument("--per-chat-rate", type=float, default=1.0, help="EditScheduler edits/s per chat")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="fake Telegram response latency (sec)")
+    parser.add_argument("--port", type=int, default=18765, help="MEXC stand-in port")
+    parser.add_argument("--telegram-port", type=int, default=18766, help="fake Telegram API port")
+    parser.add_argument("--output", help="save the report as JSON")
+    args = parser.parse_args()
+
+    # Адреса MEXC читаются config.py при импорте - задаем их до импорта сервисов
+    os.environ["MEXC_REST_URL"] = f"http://127.0.0.1:{args.port}/api/v3"
+    os.environ["MEXC_WS_URL"] = f"ws://127.0.0.1:{args.port}/ws"
+    import config
+    config.TOKEN = LOADTEST_TOKEN
+    from tools.standin import MexcStandIn, load_recording, synthetic_events
+
+    if args.recording:
+        snapshots, events = load_recording(args.recording, args.fanout)
+    else:
+        # Поток длиннее теста не нужен: стенд зацикливает его с продолжением версий
+        snapshots, events = synthetic_events(args.symbols, args.rate, duration=30)
+    standin = MexcStandIn(snapshots, events, speed=1.0, loop=True, track_send_times=True)
+    telegram = FakeTelegram(args.api_latency)
+    backend = Backend(standin, telegram, args.port, args.telegram_port)
+    backend.start()
+    backend.ready.wait()
+
+    logging.getLogger().setLevel(logging.WARNING) # Логи каждой сессии искажают замер
+    try:
+        report = asyncio.run(run_load(args, standin, telegram))
+    finally:
+        backend.stop()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
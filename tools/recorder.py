@@ -0,0 +1,119 @@
+# tools/recorder.py
+"""
+Запись живого потока стаканов MEXC в файл для офлайн-воспроизведения.
+
+    python -m tools.recorder BTCUSDT ETHUSDT --duration 600 --output rec.bin
+
+Пишет сырые Protobuf-сообщения WebSocket и REST-снимки стаканов (в начале
+записи и раз в --snapshot-interval секунд) в компактный бинарный журнал с
+временем получения (формат - benchmarks/streams.py). Журнал воспроизводят
+локальный стенд tools/standin.py и бенчмарки benchmarks/run.py.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import BinaryIO, List
+
+import aiohttp
+import websockets
+
+from benchmarks.streams import STREAM_MAGIC, write_frame, write_snapshot
+from services.pool import depth_topic
+from config import MEXC_REST_URL, MEXC_WS_URL, WS_MAX_TOPICS_PER_CONNECTION
+
+
+class Recorder:
+    """Подписывается на стаканы символов и пишет все сообщения и снимки в журнал."""
+    def __init__(self, symbols: List[str], fp: BinaryIO, snapshot_interval: float, snapshot_limit: int):
+        self.symbols = [s.replace("/", "").upper() for s in symbols]
+        self.fp = fp
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_limit = snapshot_limit
+        self.frames = 0
+        self.snapshots = 0
+        self.bytes = 0
+
+    async def _record_connection(self, symbols: List[str]):
+        """Одно соединение на не более WS_MAX_TOPICS_PER_CONNECTION символов."""
+        while True:
+            try:
+                async with websockets.connect(MEXC_WS_URL, ping_interval=25, ping_timeout=10) as ws:
+                    await ws.send(json.dumps({"method": "SUBSCRIPTION", "params": [depth_topic(s) for s in symbols]}))
+                    logging.info(f"Recorder: subscribed to {len(symbols)} symbols")
+                    async for message in ws:
+                        if isinstance(message, bytes):
+                            write_frame(self.fp, time.time(), message)
+                            self.frames += 1
+                            self.bytes += len(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Recorder: connection dropped: {e}, reconnecting in 3s")
+                await asyncio.sleep(3)
+
+    async def _record_snapshots(self, session: aiohttp.ClientSession):
+        """REST-снимки всех символов: сразу после подписки и затем периодически."""
+        await asyncio.sleep(1) # Даем подпискам установиться, чтобы дельты перекрывали снимок
+        while True:
+            for symbol in self.symbols:
+                try:
+                    params = {"symbol": symbol, "limit": self.snapshot_limit}
+                    async with session.get(f"{MEXC_REST_URL}/depth", params=params) as resp:
+                        if resp.status != 200:
+                            logging.error(f"Recorder: snapshot for {symbol} failed: HTTP {resp.status}")
+                            continue
+                        data = await resp.json()
+                    write_snapshot(self.fp, time.time(), symbol, data)
+                    self.snapshots += 1
+                except Exception as e:
+                    logging.error(f"Recorder: snapshot for {symbol} failed: {e}")
+            if not self.snapshot_interval:
+                return
+            await asyncio.sleep(self.snapshot_interval)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(10)
+            self.fp.flush()
+            logging.info(f"Recorder: {self.frames} frames, {self.snapshots} snapshots, {self.bytes / 1024:.0f} KiB")
+
+    async def run(self, duration: float):
+        async with aiohttp.ClientSession() as session:
+            batches = [
+                self.symbols[i:i + WS_MAX_TOPICS_PER_CONNECTION]
+                for i in range(0, len(self.symbols), WS_MAX_TOPICS_PER_CONNECTION)
+            ]
+            tasks = [asyncio.create_task(self._record_connection(batch)) for batch in batches]
+            tasks.append(asyncio.create_task(self._record_snapshots(session)))
+            tasks.append(asyncio.create_task(self._report()))
+            try:
+                await asyncio.sleep(duration) if duration else await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record MEXC depth streams to a replayable log")
+    parser.add_argument("symbols", nargs="+", help="symbols to record, e.g. BTCUSDT ETHUSDT")
+    parser.add_argument("--output", default="recording.bin", help="log file")
+    parser.add_argument("--duration", type=float, default=0, help="seconds to record (0 - until Ctrl+C)")
+    parser.add_argument("--snapshot-interval", type=float, default=60, help="seconds between REST snapshots (0 - only at start)")
+    parser.add_argument("--snapshot-limit", type=int, default=1000, help="levels per REST snapshot")
+    args = parser.parse_args()
+
+    with open(args.output, "wb") as fp:
+        fp.write(STREAM_MAGIC)
+        recorder = Recorder(args.symbols, fp, args.snapshot_interval, args.snapshot_limit)
+        try:
+            asyncio.run(recorder.run(args.duration))
+        except KeyboardInterrupt:
+            pass
+        logging.info(f"Recorder: saved {recorder.frames} frames and {recorder.snapshots} snapshots to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+# tools/standin.py
+"""
+Локальный стенд MEXC: REST (/api/v3/depth, /api/v3/defaultSymbols,
+/api/v3/exchangeInfo) и WebSocket (/ws), воспроизводящий записанный
+(tools/recorder.py) или синтетический поток стаканов.
+
+    python -m tools.standin --recording rec.bin --speed 10 --loop
+    python -m tools.standin --synthetic 200 --rate 10
+
+Бот направляется на стенд переменными окружения:
+
+    MEXC_REST_URL=http://127.0.0.1:8765/api/v3 MEXC_WS_URL=ws://127.0.0.1:8765/ws python main.py
+
+Стенд ведет собственный стакан каждого символа (services.orderbook.OrderBook)
+и применяет к нему все отправленные дельты, поэтому REST-снимок всегда
+согласован по версии с потоком. --fanout размножает записанные символы
+(BTCUSDT -> BTCUSDT, BTCUSDT2, ...), чтобы получить нагрузку сотен символов.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiohttp import web
+
+import PushDataV3ApiWrapper_pb2
+
+from benchmarks.streams import RECORD_FRAME, RECORD_SNAPSHOT, SyntheticMarket, read_records
+from services.orderbook import OrderBook
+from services.pool import DEPTH_FIELD_NAME, depth_topic, symbol_from_channel
+
+# Событие воспроизведения: (время от начала потока в секундах, символ, сообщение)
+Event = Tuple[float, str, PushDataV3ApiWrapper_pb2.PushDataV3ApiWrapper]
+# Через сколько событий подряд без ожидания отдавать управление циклу событий
+REPLAY_YIELD_EVERY = 200
+
+
+def _price_text(price: float, decimals: int) -> str:
+    return f"{price:.{decimals}f}"
+
+
+def _clone_symbol(symbol: str, index: int) -> str:
+    return symbol if index == 0 else f"{symbol}{index + 1}"
+
+
+def load_recording(path: str, fanout: int = 1) -> Tuple[Dict[str, dict], List[Event]]:
+    """
+    Загружает журнал рекордера: первый снимок каждого символа и дельты после него.
+    Дельты символа до его первого снимка отбрасываются (их нельзя согласовать со стаканом).
+    """
+    snapshots: Dict[str, dict] = {}
+    events: List[Event] = []
+    start = None
+    for received_at, kind, payload in read_records(path):
+        if start is None:
+            start = received_at
+        if kind == RECORD_SNAPSHOT:
+            record = json.loads(payload)
+            for i in range(fanout):
+                snapshots.setdefault(_clone_symbol(record["symbol"], i), record["data"])
+            continue
+        if kind != RECORD_FRAME:
+            continue
+        wrapper = PushDataV3ApiWrapper_pb2.PushDataV3ApiWrapper()
+        wrapper.ParseFromString(payload)
+        if wrapper.WhichOneof("body") != DEPTH_FIELD_NAME:
+            continue
+        symbol = wrapper.symbol or symbol_from_channel(wrapper.channel)
+        if symbol not in snapshots:
+            continue
+        for i in range(fanout):
+            clone = wrapper
+            if i:
+                clone = PushDataV3ApiWrapper_pb2.PushDataV3ApiWrapper()
+                clone.CopyFrom(wrapper)
+                clone.symbol = _clone_symbol(symbol, i)
+                clone.channel = depth_topic(clone.symbol)
+            events.append((received_at - start, clone.symbol, clone))
+    return snapshots, events
+
+
+def synthetic_events(symbols: int, rate: float, duration: float, levels: int = 200) -> Tuple[Dict[str, dict], List[Event]]:
+    """Синтетический поток: rate сообщений в секунду на символ в течение duration секунд."""
+    markets = [SyntheticMarket(f"SYM{i}USDT", levels, seed=i) for i in range(symbols)]
+    snapshots = {m.symbol: m.snapshot() for m in markets}
+    events: List[Event] = []
+    for n in range(int(rate * duration)):
+        for i, market in enumerate(markets):
+            wrapper = PushDataV3ApiWrapper_pb2.PushDataV3ApiWrapper()
+            wrapper.ParseFromString(market.next_frame())
+            # Символы сдвинуты по фазе, чтобы сообщения не приходили пачками
+            events.append(((n + i / symbols) / rate, market.symbol, wrapper))
+    events.sort(key=lambda e: e[0])
+    return snapshots, events
+
+
+class MexcStandIn:
+    """Сервер-заменитель MEXC с воспроизведением потока стаканов."""
+    def __init__(self, snapshots: Dict[str, dict], events: List[Event], speed: float = 1.0, loop: bool = False,
+                 track_send_times: bool = False):
+        self.events = events
+        self.speed = speed # 1 - реальное время, N - в N раз быстрее, 0 - максимально быстро
+        self.loop = loop
+        self.books: Dict[str, OrderBook] = {}
+        for symbol, snapshot in snapshots.items():
+            book = OrderBook() # Без политики хранения: стенд хранит стакан целиком
+            book.load_snapshot(snapshot.get("asks", []), snapshot.get("bids", []), int(snapshot.get("lastUpdateId") or 0))
+            self.books[symbol] = book
+        # Сдвиг версий на каждом круге воспроизведения, чтобы версии продолжали расти
+        self._version_offsets: Dict[str, int] = {symbol: 0 for symbol in self.books}
+        self._version_span: Dict[str, int] = {}
+        self._clients: List[Tuple[web.WebSocketResponse, Set[str]]] = []
+        self.sent = 0
+        # Время отправки последних версий: {symbol: {version: time.time()}} (для замера задержки в tools/loadtest.py)
+        self.track_send_times = track_send_times
+        self.send_times: Dict[str, Dict[int, float]] = {}
+        self.runner: Optional[web.AppRunner] = None
+        self._replay_task: Optional[asyncio.Task] = None
+
+    # --- REST ---
+
+    async def handle_depth(self, request: web.Request) -> web.Response:
+        symbol = request.query.get("symbol", "").upper()
+        book = self.books.get(symbol)
+        if book is None:
+            return web.json_response({"code": -1121, "msg": "Invalid symbol."}, status=400)
+        limit = int(request.query.get("limit", 100))
+        return web.json_response({
+            "lastUpdateId": book.version,
+            "asks": [[_price_text(p, book.decimals), repr(q)] for p, q in book.asks.top(limit)],
+            "bids": [[_price_text(p, book.decimals), repr(q)] for p, q in book.bids.top(limit)],
+        })
+
+    async def handle_default_symbols(self, request: web.Request) -> web.Response:
+        return web.json_response({"code": 200, "data": sorted(self.books)})
+
+    async def handle_exchange_info(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "symbols": [{"symbol": s, "quotePrecision": book.decimals} for s, book in self.books.items()]
+        })
+
+    # --- WebSocket ---
+
+    async def handle_ws(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        client = (ws, set())
+        self._clients.append(client)
+        try:
+            async for message in ws:
+                try:
+                    data = json.loads(message.data)
+                except (TypeError, ValueError):
+                    continue
+                method, params = data.get("method"), data.get("params", [])
+                if method == "SUBSCRIPTION":
+                    client[1].update(params)
+                elif method == "UNSUBSCRIPTION":
+                    client[1].difference_update(params)
+                elif method == "PING":
+                    await ws.send_str(json.dumps({"id": 0, "code": 0, "msg": "PONG"}))
+                    continue
+                await ws.send_str(json.dumps({"id": data.get("id", 0), "code": 0, "msg": ",".join(params)}))
+        finally:
+            self._clients.remove(client)
+        return ws
+
+    # --- Воспроизведение ---
+
+    def _prepare(self, symbol: str, wrapper) -> bytes:
+        """Применяет дельту к стакану стенда и сериализует ее с текущими версией и sendTime."""
+        depth = getattr(wrapper, DEPTH_FIELD_NAME)
+        offset = self._version_offsets[symbol]
+        from_version = int(depth.fromVersion or 0) + offset
+        to_version = int(depth.toVersion or 0) + offset
+        book = self.books[symbol]
+        if to_version and to_version <= book.version:
+            return b"" # Дельта уже учтена в снимке
+        book.apply_depth(depth.asks, depth.bids, to_version or None)
+
+        message = PushDataV3ApiWrapper_pb2.PushDataV3ApiWrapper()
+        message.CopyFrom(wrapper)
+        message_depth = getattr(message, DEPTH_FIELD_NAME)
+        message_depth.fromVersion = str(from_version)
+        message_depth.toVersion = str(to_version)
+        now = time.time()
+        message.sendTime = int(now * 1000)
+        if self.track_send_times and to_version:
+            sent = self.send_times.setdefault(symbol, {})
+            sent[to_version] = now
+            if len(sent) > 2000:
+                del sent[next(iter(sent))] # Храним только недавние версии
+        return message.SerializeToString()
+
+    async def _broadcast(self, symbol: str, raw: bytes):
+        topic = depth_topic(symbol)
+        for ws, topics in list(self._clients):
+            if topic in topics and not ws.closed:
+                try:
+                    await ws.send_bytes(raw)
+                    self.sent += 1
+                except ConnectionResetError:
+                    pass
+
+    async def _replay(self):
+        """Отправляет события потока с исходными интервалами, деленными на speed."""
+        if not self.events:
+            logging.info("Stand-in: no events to replay, serving snapshots only")
+            return # С пустым потоком --loop крутился бы вхолостую
+        # Размах версий каждого символа за круг: следующий круг продолжает версии с последней
+        first: Dict[str, int] = {}
+        last: Dict[str, int] = {}
+        for _, symbol, wrapper in self.events:
+            depth = getattr(wrapper, DEPTH_FIELD_NAME)
+            first.setdefault(symbol, int(depth.fromVersion or 0))
+            last[symbol] = int(depth.toVersion or 0)
+        self._version_span = {symbol: last[symbol] - first[symbol] + 1 for symbol in last}
+        while True:
+            started = time.monotonic()
+            busy = 0 # Событий подряд без ожидания
+            for offset_s, symbol, wrapper in self.events:
+                if self.speed:
+                    delay = started + offset_s / self.speed - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                        busy = 0
+                raw = self._prepare(symbol, wrapper)
+                if raw:
+                    await self._broadcast(symbol, raw)
+                busy += 1
+                if busy >= REPLAY_YIELD_EVERY:
+                    busy = 0
+                    await asyncio.sleep(0) # Без пауз даем поработать обработчикам REST и WS
+            if not self.loop:
+                logging.info(f"Stand-in: replay finished, {self.sent} messages sent")
+                return
+            for symbol, span in self._version_span.items():
+                self._version_offsets[symbol] += span
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765):
+        app = web.Application()
+        app.router.add_get("/ws", self.handle_ws)
+        app.router.add_get("/api/v3/depth", self.handle_depth)
+        app.router.add_get("/api/v3/defaultSymbols", self.handle_default_symbols)
+        app.router.add_get("/api/v3/exchangeInfo", self.handle_exchange_info)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self._replay_task = asyncio.create_task(self._replay())
+        logging.info(
+            f"Stand-in: http://{host}:{port}/api/v3, ws://{host}:{port}/ws - "
+            f"{len(self.books)} symbols, {len(self.events)} events, speed {self.speed or 'max'}"
+        )
+
+    async def stop(self):
+        if self._replay_task:
+            self._replay_task.cancel()
+            try:
+                await self._replay_task
+            except asyncio.CancelledError:
+                pass
+        if self.runner:
+            await self.runner.cleanup()
+
+
+async def _serve(standin: MexcStandIn, host: str, port: int):
+    await standin.start(host, port)
+    try:
+        while True:
+            await asyncio.sleep(10)
+            logging.info(f"Stand-in: {standin.sent} messages sent, {len(standin._clients)} clients")
+    finally:
+        await standin.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local MEXC REST/WebSocket stand-in replaying depth streams")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--recording", help="log written by tools.recorder")
+    source.add_argument("--synthetic", type=int, metavar="SYMBOLS", help="number of synthetic symbols")
+    parser.add_argument("--rate", type=float, default=10, help="synthetic messages per second per symbol")
+    parser.add_argument("--duration", type=float, default=60, help="synthetic stream length before looping (sec)")
+    parser.add_argument("--fanout", type=int, default=1, help="clone each recorded symbol N times")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed: 1 - real time, N - N times faster, 0 - max")
+    parser.add_argument("--loop", action="store_true", help="replay the stream in a loop")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.recording:
+        snapshots, events = load_recording(args.recording, args.fanout)
+    else:
+        snapshots, events = synthetic_events(args.synthetic, args.rate, args.duration)
+    standin = MexcStandIn(snapshots, events, args.speed, args.loop)
+    try:
+        asyncio.run(_serve(standin, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,113 +1,123 @@
 # utils.py
+import time
+from collections import OrderedDict
 from datetime import datetime
 
-def format_compact_price(price):
-    """
-    Форматирует цену в компактный вид.
-    Если цена имеет много нулей (например, 0.00000000123), используется нотация 0.0{8}123.
-    Если цена > 1, отображается с двумя знаками после запятой.
-    """
-    f_price = float(price)
-    
-    # Если цена больше 1, используем стандартный формат (например, 45,000.00)
-    if f_price > 1.0:
-        return f"{f_price:,.2f}"
-    
-    # Преобразуем в строку с высокой точностью, чтобы избежать научной нотации (1e-10)
-    # 20 знаков обычно достаточно для любой крипты
-    s_price = f"{f_price:.20f}".rstrip('0')
-    
-    if '.' not in s_price:
-        return s_price
-
-    integer_part, decimal_part = s_price.split('.')
-    
-    # Считаем ведущие нули в дробной части
-    leading_zeros = 0
-    for char in decimal_part:
-        if char == '0':
-            leading_zeros += 1
-        else:
-            break
-    
-    # Порог срабатывания: если нулей больше 3 (например, 0.00005)
-    if leading_zeros > 3:
-        # Берем 4 значащих цифры после нулей
-        significant_digits = decimal_part[leading_zeros:][:5]
-        return f"0.0{{{leading_zeros}}}{significant_digits}"
-    
-    # Если нулей мало (например, 0.0012), просто возвращаем как есть (до 8 знаков)
-    return f"{f_price:.8f}".rstrip('0')
+from services.orderbook import depth_stats # Агрегаты топ-N уровней (объемы, спред, дисбаланс)
+from formatting import get_formatter # Форматирование цен и строк уровней с кэшами по символу
+from services.metrics import RENDER_SECONDS # Время отрисовки (с попаданием в кэш и без)
+from config import RENDER_CACHE_SIZE, ORDERBOOK_SHOW_DATA_TIME
 
-def format_orderbook(symbol, data, depth):
-    """
-    Формирует финальный текст стакана для Telegram-сообщения.
-    Использует невидимые символы (U+2800, '⠀') для выравнивания.
-    data: структура {'asks': [{'price': ..., 'quantity': ...}], 'bids': ...}
-    """
-    if not data or not data.get('asks') or not data.get('bids'):
-        return "⏳ Ожидание данных стакана..."
+# Кэш отрисованного тела стакана: {(symbol, depth): (представление OrderBook.view(), текст)}
+_render_cache = OrderedDict()
+# Счетчики попаданий в кэш отрисовки (для диагностики)
+render_stats = {"hits": 0, "misses": 0}
+# Начало подвала со временем данных (ORDERBOOK_SHOW_DATA_TIME)
+DATA_TIME_LABEL = "🕒 Data: "
 
+def _render_body(symbol, data, depth):
+    """Текст стакана без заголовка (прогресс-бар, уровни, спред)."""
     # Берем срез данных согласно глубине
     asks = data['asks'][:depth]
     bids = data['bids'][:depth]
-    
-    # Инвертируем asks, чтобы самые дешевые продажи были внизу (ближе к спреду)
-    asks = asks[::-1] 
+
+    # Готовые агрегаты стакана подходят, только если посчитаны для той же глубины
+    stats = data.get('stats')
+    if stats is None or len(data['asks']) > depth or len(data['bids']) > depth:
+        stats = depth_stats(asks, bids)
 
     # Визуальный прогресс бар (эмуляция давления)
-    try:
-        total_ask_vol = sum(float(a['quantity']) for a in asks)
-        total_bid_vol = sum(float(b['quantity']) for b in bids)
-        total = total_ask_vol + total_bid_vol if (total_ask_vol + total_bid_vol) > 0 else 1
-        
-        buy_ratio = int((total_bid_vol / total) * 10) # Соотношение покупок (0-10)
-        sell_ratio = 10 - buy_ratio
-        progress_bar = f"[{'🟥' * sell_ratio}{'🟩' * buy_ratio}]"
-    except Exception:
-        progress_bar = "[-----]"
-    
-    time_now = datetime.now().strftime("%H:%M:%S")
-    
-    # Заголовки и начало списка
-    lines = [f"📊 {symbol} | {time_now}", progress_bar, "", "🔴 SELL (Asks):"]
-    
+    buy_ratio = int(stats['buy_ratio'] * 10) # Соотношение покупок (0-10)
+    sell_ratio = 10 - buy_ratio
+    progress_bar = f"[{'🟥' * sell_ratio}{'🟩' * buy_ratio}]"
+
+    # Форматтер символа: формат цены по точности символа, кэши цен и строк уровней
+    formatter = get_formatter(symbol, data.get('decimals'))
+
+    lines = [progress_bar, "", "🔴 SELL (Asks):"]
+
     # --- Форматирование ASK (Продажи) ---
-    for ask in asks:
-        p = format_compact_price(ask['price'])
-        v = float(ask['quantity'])
-        # Форматируем объем: если большой - без дробей, если маленький - с дробями
-        v_str = f"{v:,.0f}" if v > 100 else f"{v:.4f}"
-        v_usd = v * float(ask['price'])
-        # Выравнивание с помощью невидимых символов '⠀'
-        t1 = '⠀' * (12 - len(p))  # Выравнивание по цене
-        t2 = '⠀' * (12 - len(v_str))  # Выравнивание по объему
-        lines.append(f"{p} {t1}| {v_str} {t2}| ${v_usd:,.2f}")
-        
+    # Инвертируем asks, чтобы самые дешевые продажи были внизу (ближе к спреду)
+    lines.extend(formatter.side(reversed(asks)))
+
     lines.append("")
     lines.append("🟢 BUY (Bids):")
-    
+
     # --- Форматирование BID (Покупки) ---
-    for bid in bids:
-        p = format_compact_price(bid['price'])
-        v = float(bid['quantity'])
-        v_str = f"{v:,.0f}" if v > 100 else f"{v:.4f}"
-        v_usd = v * float(bid['price'])
-        # Выравнивание с помощью невидимых символов '⠀'
-        t1 = '⠀' * (12 - len(p))  # Выравнивание по цене
-        t2 = '⠀' * (12 - len(v_str))  # Выравнивание по объему
-        lines.append(f"{p} {t1}| {v_str} {t2}| ${v_usd:,.2f}")
-        
-    # --- Расчет и вывод спреда ---
-    if asks and bids:
-        try:
-            best_ask = float(asks[-1]['price']) # Самый нижний ask
-            best_bid = float(bids[0]['price'])  # Самый верхний bid
-            spread = best_ask - best_bid
-            spread_percent = (spread / best_ask) * 100
-            lines.append("")
-            lines.append(f"Spread: {spread_percent:.3f}%")
-        except Exception:
-            pass
-            
-    return "\n".join(lines)
\ No newline at end of file
+    lines.extend(formatter.side(bids))
+
+    # --- Вывод спреда ---
+    if stats['spread_pct'] is not None:
+        lines.append("")
+        lines.append(f"Spread: {stats['spread_pct']:.3f}%")
+
+    return "\n".join(lines)
+
+def _data_time_footer(data):
+    """Подвал со временем данных: время отправки биржей, иначе время получения ботом."""
+    if data.get('exchange_time'):
+        moment, source = datetime.fromtimestamp(data['exchange_time'] / 1000), "MEXC"
+    elif data.get('received_at'):
+        moment, source = datetime.fromtimestamp(data['received_at']), "received"
+    else:
+        moment, source = datetime.now(), "now"
+    return f"{DATA_TIME_LABEL}{moment.strftime('%H:%M:%S.%f')[:-3]} ({source})"
+
+def format_orderbook(symbol, data, depth):
+    """
+    Формирует финальный текст стакана для Telegram-сообщения.
+    Использует невидимые символы (U+2800, '⠀') для выравнивания.
+    data: структура OrderBook.view(): {'asks': [(price, quantity), ...], 'bids': ...,
+    'stats': агрегаты depth_stats(), 'revision': ревизия стакана} (asks - по
+    возрастанию цены, bids - по убыванию, числа уже float). Без 'stats' агрегаты
+    считаются здесь же.
+
+    С ORDERBOOK_SHOW_DATA_TIME вместо текущего времени в заголовке выводится подвал
+    со временем данных ('exchange_time' биржи или 'received_at' получения).
+
+    Тело сообщения (все, кроме заголовка со временем) кэшируется по (symbol, depth)
+    для конкретного представления OrderBook.view(): все зрители одной ревизии
+    стакана с одинаковой глубиной получают один раз отрисованный текст.
+    """
+    if not data or not data.get('asks') or not data.get('bids'):
+        return "⏳ Ожидание данных стакана..."
+
+    started = time.perf_counter()
+    key = (symbol, depth)
+    cached = _render_cache.get(key)
+    # Представление - общий объект на ревизию стакана, поэтому проверяем именно его
+    if cached is not None and cached[0] is data:
+        _render_cache.move_to_end(key)
+        render_stats["hits"] += 1
+        body = cached[1]
+        cache = "hit"
+    else:
+        render_stats["misses"] += 1
+        body = _render_body(symbol, data, depth)
+        cache = "miss"
+        if 'revision' in data: # Кэшируем только представления стакана, а не разовые словари
+            _render_cache[key] = (data, body)
+            _render_cache.move_to_end(key)
+            if len(_render_cache) > RENDER_CACHE_SIZE:
+                _render_cache.popitem(last=False)
+
+    if ORDERBOOK_SHOW_DATA_TIME:
+        text = f"📊 {symbol}\n{body}\n\n{_data_time_footer(data)}"
+    else:
+        time_now = datetime.now().strftime("%H:%M:%S")
+        text = f"📊 {symbol} | {time_now}\n{body}"
+    RENDER_SECONDS.labels(cache).observe(time.perf_counter() - started)
+    return text
+
+def orderbook_fingerprint(text, include_timestamp=False):
+    """
+    Отпечаток текста стакана для пропуска повторных правок.
+    По умолчанию первая строка (символ и время из format_orderbook) и подвал со
+    временем данных не учитываются, чтобы смена одного только времени не считалась
+    изменением стакана.
+    """
+    if not include_timestamp:
+        text = text.partition("\n")[2]
+        if ORDERBOOK_SHOW_DATA_TIME:
+            text = text.rpartition(f"\n\n{DATA_TIME_LABEL}")[0] or text
+    return hash(text)
\ No newline at end of file